@@ -1,9 +1,9 @@
 from typing import Dict, Any
-from rag.pipeline import RAGPipeline
+from services.model_registry import registry
 
 class AssistantAgent:
     def __init__(self):
-        self.rag_pipeline = RAGPipeline()
+        self.rag_pipeline = registry.get("rag_pipeline")
         
     async def process_goal(self, goal: str) -> Dict[str, Any]:
         return await self.rag_pipeline.process_query(goal)
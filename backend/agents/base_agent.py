@@ -1,10 +1,25 @@
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional
+from functools import wraps
+from services.metrics import metrics
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _traced(process):
+    @wraps(process)
+    async def traced_process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        with metrics.timer("agent_process_seconds", agent=self.name):
+            return await process(self, input_data)
+    return traced_process
+
 class BaseAgent(ABC):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every agent's process() is timed without each subclass opting in
+        if "process" in cls.__dict__:
+            cls.process = _traced(cls.process)
+    
     def __init__(self, name: str):
         self.name = name
         self.logger = logging.getLogger(f"{__name__}.{name}")
@@ -0,0 +1,209 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Type
+from pydantic import BaseModel
+from models.schemas import FinancialPlan, UserProfile
+from services.metrics import metrics
+import re
+
+
+class Section(NamedTuple):
+    field: str
+    # Headings the model may use for this field, matched case-insensitively
+    aliases: Tuple[str, ...]
+    is_list: bool = False
+
+
+class OutputSchema:
+    """The sections an agent asks the model for, in prompt order, and the model they fill."""
+
+    def __init__(self, name: str, model: Type[BaseModel], sections: Sequence[Section]):
+        self.name = name
+        self.model = model
+        self.sections = list(sections)
+        self.fields = [section.field for section in self.sections]
+        # Longest alias first, so "risk tolerance" wins over "risk"
+        self.aliases = sorted(
+            ((alias, section.field) for section in self.sections for alias in section.aliases),
+            key=lambda item: len(item[0]),
+            reverse=True
+        )
+
+    def section(self, field: str) -> Section:
+        return self.sections[self.fields.index(field)]
+
+
+PLAN_SCHEMA = OutputSchema("plan", FinancialPlan, [
+    Section("goal", ("main goal", "goal", "objective")),
+    Section("steps", ("specific steps to achieve this goal", "specific steps", "action steps", "steps"), True),
+    Section("timeline", ("timeline", "time frame", "timeframe")),
+    Section("estimated_cost", ("estimated costs", "estimated cost", "costs", "cost")),
+    Section("risks", ("potential risks", "risk factors", "risks"), True),
+    Section("recommendations", ("recommendations", "recommendation"), True),
+])
+
+PROFILE_SCHEMA = OutputSchema("profile", UserProfile, [
+    Section("financial_goals", ("financial goals", "goals")),
+    Section("risk_tolerance", ("risk tolerance",)),
+    Section("time_horizon", ("time horizon",)),
+    Section("current_situation", ("current financial situation", "current situation", "financial situation")),
+    Section("investment_preferences", ("investment preferences", "preferences")),
+])
+
+_NUMBERED = re.compile(r"^(\d{1,2})[.)]\s*(.*)$")
+_BULLET = re.compile(r"^(?:[-*•+]|\d{1,2}[.)])\s+")
+# What may follow a heading: an optional "(unit)", then a colon, a spaced dash or nothing
+_SEPARATOR = re.compile(r"^\s*(?:\([^)]*\))?[\s*_]*(?::|[-–—](?=\s)|$)")
+_SENTENCE = re.compile(r"(?<=[.!?;])\s+")
+# Commentary models append after the requested sections
+_TRAILER = re.compile(r"^(?:notes?|response|summary|in summary|disclaimer|conclusion)\b\s*:", re.IGNORECASE)
+
+
+class StructuredOutputParser:
+    """Incrementally parses LLM output into the fields of an OutputSchema.
+
+    Understands headed sections ("Timeline: ...", "## Risks", "**Steps**"),
+    numbered sections with or without headings ("3. Timeline: ..." or just
+    "3. 18 months" in prompt order), and bulleted or numbered list items
+    within a section. Feed chunks as they stream in; ``feed`` returns True
+    once every field is filled and the model has moved past the last one
+    (restarting the sections or adding commentary), so generation can stop.
+    ``finish`` repairs what is missing and validates against the schema.
+    """
+
+    def __init__(self, schema: OutputSchema):
+        self.schema = schema
+        self.done = False
+        # Fields whose value had to be filled in or recovered by ``finish``
+        self.repaired: List[str] = []
+        self._buffer = ""
+        self._values: Dict[str, List[str]] = {}
+        self._current: Optional[str] = None
+        self._preamble: List[str] = []
+        # Numbered sections without headings, mapped by position
+        self._positional: Optional[bool] = None
+        self._last_number = 0
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk of output; returns True when generation can stop."""
+        if self.done:
+            return True
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            self._consume(line)
+            if self.done:
+                break
+        return self.done
+
+    def _filled(self) -> bool:
+        return all(self._values.get(field) for field in self.schema.fields)
+
+    def _match_heading(self, line: str) -> Optional[Tuple[Optional[str], str]]:
+        """(field, inline text) if the line opens a section; field None for unknown headings."""
+        text = re.sub(r"^[#>*_\s]+", "", line)
+        number = None
+        numbered = _NUMBERED.match(text)
+        if numbered:
+            number, text = int(numbered.group(1)), numbered.group(2)
+        text = text.lstrip("*_ ")
+        lower = text.lower()
+        for alias, field in self.schema.aliases:
+            separator = _SEPARATOR.match(text[len(alias):]) if lower.startswith(alias) else None
+            if separator:
+                self._positional = False
+                if number:
+                    self._last_number = number
+                return field, text[len(alias) + separator.end():].strip(" *_")
+        if number is None or (self._current and self.schema.section(self._current).is_list
+                              and self._positional is False):
+            return None
+        if self._positional is None and number == 1 and not self._values:
+            self._positional = True
+        if self._positional and number == self._last_number + 1:
+            self._last_number = number
+            if number > len(self.schema.fields):
+                return None, text
+            return self.schema.fields[number - 1], text.strip("*_ ")
+        return None
+
+    def _consume(self, line: str):
+        stripped = line.strip()
+        if not stripped:
+            return
+        heading = self._match_heading(stripped)
+        if heading is None and self._filled() and _TRAILER.match(stripped.lstrip("#*_ ")):
+            heading = (None, "")
+        if heading is not None:
+            field, inline = heading
+            if self._filled() and (field is None or field != self._current):
+                # Every field has content and the model is starting over or
+                # adding commentary: the rest would be thrown away
+                self.done = True
+                return
+            if field is None:
+                return
+            self._current = field
+            if inline:
+                self._add(field, inline)
+            return
+        if self._current is None:
+            self._preamble.append(stripped)
+            return
+        self._add(self._current, stripped)
+
+    def _add(self, field: str, text: str):
+        if self.schema.section(field).is_list:
+            text = _BULLET.sub("", text)
+        text = text.strip("*_ ")
+        if text:
+            self._values.setdefault(field, []).append(text)
+
+    def finish(self, defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Return the parsed fields, repaired and validated against the schema.
+
+        Output with no recognizable sections is mapped line by line in prompt
+        order; text before the first section becomes the first field if that
+        is empty; any field still missing takes its value from ``defaults``
+        or is left empty.
+        """
+        if self._buffer and not self.done:
+            self._consume(self._buffer)
+        self._buffer = ""
+
+        values = {field: list(lines) for field, lines in self._values.items()}
+        if not values and self._preamble:
+            # Unstructured output: one line per field, as the prompts ask
+            for field, line in zip(self.schema.fields, self._preamble):
+                values[field] = [line]
+                self.repaired.append(field)
+        elif self._preamble and not values.get(self.schema.fields[0]):
+            values[self.schema.fields[0]] = self._preamble
+            self.repaired.append(self.schema.fields[0])
+
+        data: Dict[str, Any] = {}
+        for section in self.schema.sections:
+            lines = values.get(section.field)
+            if not lines:
+                if section.field not in self.repaired:
+                    self.repaired.append(section.field)
+                if defaults and section.field in defaults:
+                    data[section.field] = defaults[section.field]
+                else:
+                    data[section.field] = [] if section.is_list else ""
+                continue
+            if section.is_list:
+                data[section.field] = [
+                    item.rstrip(".").strip() for line in lines for item in _SENTENCE.split(line)
+                    if item.rstrip(".").strip()
+                ]
+            else:
+                data[section.field] = " ".join(lines)
+        metrics.inc("structured_output_total", schema=self.schema.name,
+                    outcome="repaired" if self.repaired else "complete")
+        return self.schema.model(**data).dict()
+
+
+def parse_output(text: str, schema: OutputSchema, defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Parse a complete LLM response into the schema's fields."""
+    parser = StructuredOutputParser(schema)
+    parser.feed(text)
+    return parser.finish(defaults)
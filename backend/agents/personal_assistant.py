@@ -1,62 +1,154 @@
-from typing import Dict, Any
+from typing import Any, AsyncIterator, Callable, Dict, Optional
 from .base_agent import BaseAgent
 from .profile_agent import ProfileAgent
 from .planner_agent import PlannerAgent
-from rag.pipeline import RAGPipeline
+from .stage_graph import StageGraph
+from services.model_registry import registry
+from services.metrics import set_trace_id
 from models.user_session import UserSession
-from services.session_manager import SessionManager
+from datetime import datetime
+import asyncio
 import json
 
+# Progress events sent to streaming clients as stages finish
+STAGE_MESSAGES = {
+    "profile": "profile done",
+    "context": "context retrieved"
+}
+
 class PersonalAssistant(BaseAgent):
     def __init__(self):
         super().__init__("personal_assistant")
         self.profile_agent = ProfileAgent()
         self.planner_agent = PlannerAgent()
-        self.rag_pipeline = RAGPipeline()
-        self.session_manager = SessionManager()
+        self.rag_pipeline = registry.get("rag_pipeline")
+        self.session_manager = registry.get("session_manager")
     
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._run_turn(input_data)
+    
+    async def process_stream(self, input_data: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Run a turn, yielding stage and token events before the final plan.
+        
+        Events are ``{"type": "stage", ...}`` as each stage completes,
+        ``{"type": "token", "delta": ...}`` while the planner generates, and a
+        final ``{"type": "plan", ...}`` carrying the same payload ``process``
+        returns.
+        """
+        events: asyncio.Queue = asyncio.Queue()
+        turn = asyncio.ensure_future(self._run_turn(input_data, emit=events.put_nowait))
+        try:
+            while True:
+                next_event = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({next_event, turn}, return_when=asyncio.FIRST_COMPLETED)
+                if next_event in done:
+                    yield next_event.result()
+                    continue
+                next_event.cancel()
+                while not events.empty():
+                    yield events.get_nowait()
+                break
+        finally:
+            # The client went away mid-stream; don't leave the turn running
+            if not turn.done():
+                turn.cancel()
+        
+        yield {"type": "plan", **turn.result()}
+    
+    async def _run_turn(self, input_data: Dict[str, Any],
+                        emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        session_id = input_data.get("session_id")
+        if not session_id:
+            return await self._turn(input_data, emit)
+        # Turns of one session run one at a time; concurrent ones would
+        # interleave their messages in the shared session object
+        async with self.session_manager.session_lock(session_id):
+            return await self._turn(input_data, emit)
+    
+    async def _turn(self, input_data: Dict[str, Any],
+                    emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        session = None
+        committed = False
         try:
             self.log_info(f"Processing user input: {input_data.get('text', '')}")
+            received_at = datetime.now()
             
             # Get or create session
             session_id = input_data.get("session_id")
             session = self.session_manager.get_session(session_id)
             if not session:
                 session = self.session_manager.create_session()
+            # Log lines for this turn, including from stage tasks, carry the session id
+            set_trace_id(session.id)
+            
+            # The user message is added with the reply, when the turn commits
+            user_text = input_data.get("text", "")
+            
+            def on_stage_done(stage: str, result: Dict[str, Any], duration_ms: float):
+                if emit and stage in STAGE_MESSAGES:
+                    emit({
+                        "type": "stage",
+                        "stage": stage,
+                        "success": result["success"],
+                        "message": STAGE_MESSAGES[stage],
+                        "duration_ms": duration_ms
+                    })
             
-            # Add user message to history
-            session.add_message("user", input_data.get("text", ""))
+            graph = StageGraph(name=self.name, on_stage_done=on_stage_done)
             
-            # Step 1: Analyze user profile (if not exists or needs update)
-            if not session.user_profile:
-                profile_result = await self.profile_agent.process(input_data)
-                if not profile_result["success"]:
-                    return profile_result
-                session.update_profile(profile_result["data"])
+            # Step 1: Update the profile. Rules run on every message, before
+            # retrieval so it sees this turn's changes; the LLM only runs when
+            # the rules can't read the message confidently
+            had_profile = bool(session.user_profile)
+            profile_matches = self.profile_agent.apply_rules(session, user_text)
+            needs_llm = self.profile_agent.needs_llm(profile_matches, had_profile)
             
-            # Step 2: Get relevant context from RAG pipeline
-            rag_result = await self.rag_pipeline.process_query(input_data.get("text", ""))
-            if not rag_result["success"]:
-                return rag_result
+            async def profile_stage(_: Dict[str, Any]) -> Dict[str, Any]:
+                if not needs_llm:
+                    return {"success": True, "data": session.user_profile}
+                return await self.profile_agent.refine(session, input_data, profile_matches)
+            
+            # Step 2: Retrieve relevant advice (independent of the profile); the
+            # planner is the only stage that generates text
+            async def context_stage(_: Dict[str, Any]) -> Dict[str, Any]:
+                return await self.rag_pipeline.retrieve(user_text, profile=session.user_profile)
             
             # Step 3: Generate comprehensive financial plan
-            planning_input = {
-                "profile": session.user_profile,
-                "goal": input_data.get("text", ""),
-                "context": rag_result["data"],
-                "conversation_history": [msg.dict() for msg in session.get_recent_messages(5)]
-            }
+            async def plan_stage(results: Dict[str, Any]) -> Dict[str, Any]:
+                for dependency in ("profile", "context"):
+                    if not results[dependency]["success"]:
+                        return results[dependency]
+                planning_input = {
+                    "profile": session.user_profile,
+                    "goal": user_text,
+                    "context": results["context"]["data"],
+                    # Earlier turns; the prompt builder summarizes all but the latest
+                    "conversation_history": session.conversation_history[:],
+                    "session_id": session.id
+                }
+                if not emit:
+                    return await self.planner_agent.process(planning_input)
+                async for event in self.planner_agent.process_stream(planning_input):
+                    if event["type"] == "result":
+                        return event["result"]
+                    emit(event)
+            
+            graph.add_stage("profile", profile_stage)
+            graph.add_stage("context", context_stage)
+            graph.add_stage("plan", plan_stage, depends_on=["profile", "context"])
+            results = await graph.run()
             
-            plan_result = await self.planner_agent.process(planning_input)
+            rag_result = results["context"]
+            plan_result = results["plan"]
             if not plan_result["success"]:
                 return plan_result
             
-            # Add assistant response to history
+            # Commit the turn: both messages and the profile changes are saved
+            # together, with no await in between for a cancellation to land on
+            session.add_message("user", user_text, timestamp=received_at)
             session.add_message("assistant", json.dumps(plan_result["data"]), plan_result["data"])
-            
-            # Update session
             self.session_manager.update_session(session)
+            committed = True
             
             # Combine all results
             final_response = {
@@ -65,13 +157,21 @@ class PersonalAssistant(BaseAgent):
                 "data": {
                     "session_id": session.id,
                     "profile": session.user_profile,
+                    "profile_version": session.profile_version,
                     "context": rag_result["data"],
                     "plan": plan_result["data"],
-                    "conversation_history": [msg.dict() for msg in session.get_recent_messages(5)]
+                    # JSON-safe (timestamps as strings) so /ws can send it as-is
+                    "conversation_history": [json.loads(msg.json()) for msg in session.get_recent_messages(5)],
+                    "timings": graph.timings
                 }
             }
             
             return final_response
             
         except Exception as e:
-            return await self.handle_error(e) 
\ No newline at end of file
+            return await self.handle_error(e)
+        finally:
+            if session is not None and not committed:
+                # Failed or cancelled (e.g. superseded): roll back this turn's
+                # profile changes by reloading the last saved copy next time
+                self.session_manager.discard_changes(session)
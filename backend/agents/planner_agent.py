@@ -1,23 +1,30 @@
-from typing import Dict, Any
+from typing import Any, AsyncIterator, Dict, List
 from .base_agent import BaseAgent
-from langchain_community.llms import HuggingFaceHub
 from langchain.prompts import PromptTemplate
+from services.model_registry import registry
+from services.metrics import metrics
+from .prompt_builder import PromptBuilder, TokenCounter
+from .output_parser import PLAN_SCHEMA, StructuredOutputParser, parse_output
+import hashlib
 
 class PlannerAgent(BaseAgent):
     def __init__(self):
         super().__init__("planner_agent")
-        self.llm = HuggingFaceHub(
-            repo_id="google/flan-t5-small",
-            model_kwargs={"temperature": 0.7, "max_length": 512}
-        )
+        # Shared LLM client and executor from the process-wide registry
+        self.llm_executor = registry.get("llm_executor")
+        self.llm = self.llm_executor.llm
+        self.response_cache = registry.get("response_cache")
         
         self.planning_prompt = PromptTemplate(
-            input_variables=["profile", "goal", "context"],
+            input_variables=["profile", "goal", "context", "history"],
             template="""Based on the following information:
             
             User Profile:
             {profile}
             
+            Conversation So Far:
+            {history}
+            
             Financial Goal:
             {goal}
             
@@ -34,35 +41,93 @@ class PlannerAgent(BaseAgent):
             
             Response:"""
         )
+        # Keeps prompts within the model's input limit however long the conversation
+        self.prompt_builder = PromptBuilder(self.planning_prompt, TokenCounter(registry.get("tokenizer")))
+    
+    def _context_doc_ids(self, context: Any) -> List[str]:
+        """Ids of the retrieved documents, used as part of the cache key."""
+        if isinstance(context, dict) and "documents" in context:
+            return [doc["id"] for doc in context["documents"]]
+        return [hashlib.sha1(str(context).encode("utf-8")).hexdigest()[:16]]
+    
+    def _cache_args(self, input_data: Dict[str, Any]):
+        doc_ids = self._context_doc_ids(input_data.get("context", ""))
+        # The prompt quotes the conversation, so a follow-up only matches plans
+        # generated for the same conversation
+        history_key = self.prompt_builder.history_key(input_data.get("conversation_history"))
+        if history_key:
+            doc_ids.append(f"history:{history_key}")
+        return ("plan", input_data.get("goal", ""), input_data.get("profile"), doc_ids)
+    
+    def _build_prompt(self, input_data: Dict[str, Any]) -> str:
+        return self.prompt_builder.build(
+            input_data.get("goal", ""),
+            input_data.get("profile"),
+            input_data.get("context", ""),
+            history=input_data.get("conversation_history"),
+            session_id=input_data.get("session_id")
+        )
+    
+    def _parse_plan(self, response: str, goal: str) -> Dict[str, Any]:
+        """Parse the raw LLM response into structured plan data."""
+        with metrics.timer("parse_seconds", agent=self.name):
+            return parse_output(response, PLAN_SCHEMA, defaults={"goal": goal})
     
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         try:
             self.log_info(f"Processing financial plan for goal: {input_data.get('goal', '')}")
             
+            cached = await self.response_cache.aget(*self._cache_args(input_data))
+            if cached is not None:
+                return cached
+            
             # Generate financial plan
-            prompt = self.planning_prompt.format(
-                profile=input_data.get("profile", ""),
-                goal=input_data.get("goal", ""),
-                context=input_data.get("context", "")
-            )
-            response = self.llm(prompt)
+            prompt = self._build_prompt(input_data)
+            response = await self.llm_executor.agenerate(prompt)
             
-            # Parse the response into structured data
-            sections = response.split("\n")
-            plan = {
-                "goal": sections[0] if len(sections) > 0 else "",
-                "steps": [s.strip() for s in sections[1].split(".") if s.strip()] if len(sections) > 1 else [],
-                "timeline": sections[2] if len(sections) > 2 else "",
-                "estimated_cost": sections[3] if len(sections) > 3 else "",
-                "risks": [s.strip() for s in sections[4].split(".") if s.strip()] if len(sections) > 4 else [],
-                "recommendations": [s.strip() for s in sections[5].split(".") if s.strip()] if len(sections) > 5 else []
+            result = {
+                "success": True,
+                "message": "Financial plan generated successfully",
+                "data": self._parse_plan(response, input_data.get("goal", ""))
             }
+            await self.response_cache.aput(*self._cache_args(input_data), result)
+            return result
             
-            return {
+        except Exception as e:
+            return await self.handle_error(e)
+    
+    async def process_stream(self, input_data: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the plan as token events, ending with a result event."""
+        try:
+            self.log_info(f"Streaming financial plan for goal: {input_data.get('goal', '')}")
+            
+            cached = await self.response_cache.aget(*self._cache_args(input_data))
+            if cached is not None:
+                yield {"type": "result", "result": cached}
+                return
+            
+            prompt = self._build_prompt(input_data)
+            parser = StructuredOutputParser(PLAN_SCHEMA)
+            stream = self.llm_executor.astream(prompt)
+            try:
+                async for chunk in stream:
+                    yield {"type": "token", "delta": chunk}
+                    if parser.feed(chunk):
+                        # Every section is filled; stop paying for tokens we'd discard
+                        break
+            finally:
+                await stream.aclose()
+            
+            with metrics.timer("parse_seconds", agent=self.name):
+                plan = parser.finish(defaults={"goal": input_data.get("goal", "")})
+            result = {
                 "success": True,
                 "message": "Financial plan generated successfully",
                 "data": plan
             }
+            await self.response_cache.aput(*self._cache_args(input_data), result)
             
         except Exception as e:
-            return await self.handle_error(e)
+            result = await self.handle_error(e)
+        
+        yield {"type": "result", "result": result}
@@ -1,15 +1,23 @@
 from typing import Dict, Any
 from .base_agent import BaseAgent
-from langchain_community.llms import HuggingFaceHub
+from .profile_extractor import FieldMatch, ProfileExtractor
+from .output_parser import PROFILE_SCHEMA, parse_output
 from langchain.prompts import PromptTemplate
+from models.user_session import UserSession
+from services.model_registry import registry
+from services.metrics import metrics
+import os
+
+# Confident rule matches a first message needs to skip LLM extraction
+PROFILE_MIN_RULE_FIELDS = int(os.getenv("PROFILE_MIN_RULE_FIELDS", "2"))
 
 class ProfileAgent(BaseAgent):
     def __init__(self):
         super().__init__("profile_agent")
-        self.llm = HuggingFaceHub(
-            repo_id="google/flan-t5-small",
-            model_kwargs={"temperature": 0.7, "max_length": 512}
-        )
+        # Shared LLM client and executor from the process-wide registry
+        self.llm_executor = registry.get("llm_executor")
+        self.llm = self.llm_executor.llm
+        self.extractor = ProfileExtractor()
         
         self.profile_prompt = PromptTemplate(
             input_variables=["user_input"],
@@ -32,17 +40,11 @@ class ProfileAgent(BaseAgent):
             
             # Generate profile analysis
             prompt = self.profile_prompt.format(user_input=input_data.get("text", ""))
-            response = self.llm(prompt)
+            response = await self.llm_executor.agenerate(prompt)
             
             # Parse the response into structured data
-            sections = response.split("\n")
-            profile = {
-                "financial_goals": sections[0] if len(sections) > 0 else "",
-                "risk_tolerance": sections[1] if len(sections) > 1 else "",
-                "time_horizon": sections[2] if len(sections) > 2 else "",
-                "current_situation": sections[3] if len(sections) > 3 else "",
-                "investment_preferences": sections[4] if len(sections) > 4 else ""
-            }
+            with metrics.timer("parse_seconds", agent=self.name):
+                profile = parse_output(response, PROFILE_SCHEMA)
             
             return {
                 "success": True,
@@ -52,3 +54,54 @@ class ProfileAgent(BaseAgent):
             
         except Exception as e:
             return await self.handle_error(e)
+    
+    def apply_rules(self, session: UserSession, text: str) -> Dict[str, FieldMatch]:
+        """Update the profile from confident rule matches in one message.
+        
+        Only fields whose value changed produce a new profile version.
+        Returns every match, confident or not, for ``needs_llm``.
+        """
+        matches = self.extractor.extract(text)
+        confident = self.extractor.confident(matches)
+        if confident:
+            changes = session.update_profile(
+                {**(session.user_profile or {}), **confident},
+                source="rules",
+                confidence={field: match.confidence for field, match in matches.items()}
+            )
+            if changes:
+                metrics.inc("profile_updates_total", source="rules")
+                self.log_info(f"Profile fields updated from rules: {sorted(changes)}")
+        return matches
+    
+    def needs_llm(self, matches: Dict[str, FieldMatch], had_profile: bool) -> bool:
+        """Whether this turn needs an LLM extraction pass.
+        
+        That is a first message the rules could not build a profile from, or
+        a profile mention the rules could not read confidently.
+        """
+        if not had_profile and len(self.extractor.confident(matches)) < PROFILE_MIN_RULE_FIELDS:
+            return True
+        return bool(self.extractor.uncertain(matches))
+    
+    async def refine(self, session: UserSession, input_data: Dict[str, Any],
+                     matches: Dict[str, FieldMatch]) -> Dict[str, Any]:
+        """Run LLM extraction and merge it into the profile.
+        
+        Confident rule matches from the same message take precedence over
+        the LLM's reading of those fields.
+        """
+        result = await self.process(input_data)
+        if not result["success"]:
+            if session.user_profile:
+                self.log_error("LLM profile extraction failed; keeping the rule-based profile")
+                return {"success": True, "message": "Profile kept", "data": session.user_profile}
+            return result
+        extracted = {field: value for field, value in result["data"].items() if value}
+        changes = session.update_profile(
+            {**(session.user_profile or {}), **extracted, **self.extractor.confident(matches)},
+            source="llm"
+        )
+        if changes:
+            metrics.inc("profile_updates_total", source="llm")
+        return {"success": True, "message": result["message"], "data": session.user_profile}
@@ -0,0 +1,152 @@
+from typing import Any, Dict, List, NamedTuple, Optional
+from datetime import datetime
+import os
+import re
+
+# Rule matches at or above this confidence update the profile without the LLM
+PROFILE_RULE_CONFIDENCE = float(os.getenv("PROFILE_RULE_CONFIDENCE", "0.6"))
+
+_NUMBER = r"\$?\s*(\d[\d,]*(?:\.\d+)?)\s*(k|m|thousand|million)?\b"
+_MULTIPLIERS = {"k": 1_000, "thousand": 1_000, "m": 1_000_000, "million": 1_000_000}
+# Periods an amount can be quoted in, as multiples per year
+_PER_YEAR = {"year": 1, "yr": 1, "annum": 1, "annually": 1, "month": 12, "mo": 12,
+             "monthly": 12, "week": 52, "weekly": 52, "hour": 2080, "hr": 2080}
+
+AGE_PATTERNS = [
+    (re.compile(r"\b(\d{2})[- ](?:years?|yrs?)[- ]old\b"), 0.95),
+    (re.compile(r"\b(?:age|aged)\s*:?\s*(\d{2})\b"), 0.9),
+    (re.compile(r"\b(?:i am|i'm|im)\s+(\d{2})\b(?!\s*(?:%|percent|k\b|years?\b(?!\s*old)))"), 0.7),
+]
+INCOME_PATTERN = re.compile(
+    r"\b(?:income|salary|earns?|earning|make(?!\s+sure)|makes|making|get paid|take home)\b[^$\d]{0,20}" + _NUMBER +
+    r"(?:\s*(?:a|an|per|each|every|/)\s*(year|yr|annum|month|mo|week|hour|hr)\b|\s*(annually|monthly|weekly))?"
+)
+HORIZON_PATTERNS = [
+    (re.compile(r"\b(\d{1,2})[- ](year|month)s?\s+(?:time\s+)?(?:horizon|timeline|time frame|timeframe)\b"), 0.95),
+    (re.compile(r"\b(?:in|within|over the next|next)\s+(\d{1,2})\s+(year|month)s?\b"), 0.8),
+]
+TARGET_YEAR_PATTERN = re.compile(r"\bby\s+(20\d{2})\b")
+DEBT_AMOUNT_PATTERN = re.compile(
+    _NUMBER + r"\s+(?:in|of|worth of)\s+(?:(student|credit card|car|auto|medical|personal)\s+)?(?:debt|loans?)\b"
+)
+DEBT_TYPE_PATTERN = re.compile(r"\b(student loans?|credit cards? debt|credit card|car loan|auto loan|mortgage|medical debt|personal loan)\b")
+NO_DEBT_PATTERN = re.compile(r"\b(?:no debts?|debt[- ]free|don't have any debt|do not have any debt)\b")
+RISK_TERMS = {
+    "low": ["conservative", "low risk", "low-risk", "risk averse", "risk-averse", "play it safe", "safe investments"],
+    "moderate": ["moderate", "balanced", "medium risk", "medium-risk"],
+    "high": ["aggressive", "high risk", "high-risk", "risk tolerant", "risk-tolerant"],
+}
+NEGATIONS = ("not", "no", "don't", "dont", "never", "avoid", "without")
+
+
+class FieldMatch(NamedTuple):
+    value: Any
+    confidence: float
+
+
+def _amount(number: str, suffix: Optional[str]) -> float:
+    value = float(number.replace(",", ""))
+    return value * _MULTIPLIERS.get((suffix or "").lower(), 1)
+
+
+def _negated(text: str, start: int) -> bool:
+    preceding = text[max(start - 20, 0):start].split()
+    return any(word in NEGATIONS for word in preceding[-3:])
+
+
+def extract_age(text: str) -> Optional[FieldMatch]:
+    for pattern, confidence in AGE_PATTERNS:
+        match = pattern.search(text)
+        if match and 16 <= int(match.group(1)) <= 100:
+            return FieldMatch(int(match.group(1)), confidence)
+    return None
+
+
+def extract_income(text: str) -> Optional[FieldMatch]:
+    match = INCOME_PATTERN.search(text)
+    if not match:
+        return None
+    amount = _amount(match.group(1), match.group(2))
+    period = match.group(3) or match.group(4)
+    if period:
+        return FieldMatch(round(amount * _PER_YEAR[period]), 0.9)
+    # No period given: large figures are almost always annual
+    return FieldMatch(round(amount), 0.75 if amount >= 10_000 else 0.4)
+
+
+def extract_time_horizon(text: str) -> Optional[FieldMatch]:
+    for pattern, confidence in HORIZON_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            count = int(match.group(1))
+            return FieldMatch(f"{count} {match.group(2)}{'s' if count != 1 else ''}", confidence)
+    match = TARGET_YEAR_PATTERN.search(text)
+    if match:
+        years = int(match.group(1)) - datetime.now().year
+        if years > 0:
+            return FieldMatch(f"{years} year{'s' if years != 1 else ''}", 0.75)
+    return None
+
+
+def extract_risk_tolerance(text: str) -> Optional[FieldMatch]:
+    found = {}
+    for level, terms in RISK_TERMS.items():
+        for term in terms:
+            start = text.find(term)
+            if start >= 0:
+                found[level] = _negated(text, start)
+                break
+    if not found:
+        return None
+    levels = [level for level, negated in found.items() if not negated]
+    if len(found) == 1 and len(levels) == 1:
+        confidence = 0.9 if "risk" in text else 0.75
+        return FieldMatch(levels[0], confidence)
+    # Negated ("not aggressive") or conflicting mentions need the LLM to read them
+    return FieldMatch(levels[0] if levels else next(iter(found)), 0.4)
+
+
+def extract_debt(text: str) -> Dict[str, FieldMatch]:
+    fields: Dict[str, FieldMatch] = {}
+    if NO_DEBT_PATTERN.search(text):
+        fields["debt"] = FieldMatch(0, 0.85)
+        return fields
+    amounts = [_amount(m.group(1), m.group(2)) for m in DEBT_AMOUNT_PATTERN.finditer(text)]
+    if amounts:
+        fields["debt"] = FieldMatch(round(sum(amounts)), 0.85)
+    types = sorted({
+        re.sub(r"s? debt$|s$", "", match.group(1)).replace("auto", "car")
+        for match in DEBT_TYPE_PATTERN.finditer(text)
+    })
+    if types:
+        fields["debt_types"] = FieldMatch(types, 0.8)
+    return fields
+
+
+class ProfileExtractor:
+    """Cheap rule-based extraction of profile facts from a single message.
+
+    Spots age, income, time horizon, risk tolerance and debt mentions and
+    scores each with a confidence; matches below ``threshold`` are reported
+    as uncertain so the caller can fall back to the LLM for them.
+    """
+
+    def __init__(self, threshold: float = PROFILE_RULE_CONFIDENCE):
+        self.threshold = threshold
+
+    def extract(self, text: str) -> Dict[str, FieldMatch]:
+        text = " ".join(text.lower().split())
+        fields: Dict[str, Optional[FieldMatch]] = {
+            "age": extract_age(text),
+            "annual_income": extract_income(text),
+            "time_horizon": extract_time_horizon(text),
+            "risk_tolerance": extract_risk_tolerance(text),
+        }
+        fields.update(extract_debt(text))
+        return {field: match for field, match in fields.items() if match is not None}
+
+    def confident(self, matches: Dict[str, FieldMatch]) -> Dict[str, Any]:
+        return {field: match.value for field, match in matches.items() if match.confidence >= self.threshold}
+
+    def uncertain(self, matches: Dict[str, FieldMatch]) -> List[str]:
+        return [field for field, match in matches.items() if match.confidence < self.threshold]
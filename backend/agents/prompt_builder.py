@@ -0,0 +1,212 @@
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "512"))
+# Most recent messages quoted in the prompt; older ones are summarized
+PROMPT_RECENT_MESSAGES = int(os.getenv("PROMPT_RECENT_MESSAGES", "4"))
+PROMPT_SUMMARY_TOKENS = int(os.getenv("PROMPT_SUMMARY_TOKENS", "96"))
+PROMPT_SUMMARY_CACHE_SIZE = int(os.getenv("PROMPT_SUMMARY_CACHE_SIZE", "1000"))
+
+# Words per token assumed when no tokenizer is available (T5-style subwords)
+TOKENS_PER_WORD = 1.3
+# Cap on a single digested turn in the running summary
+DIGEST_TOKENS = 32
+
+
+class TokenCounter:
+    """Counts tokens with the model's tokenizer, or approximates from words."""
+
+    def __init__(self, tokenizer: Optional[Any] = None):
+        self.tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return math.ceil(len(text.split()) * TOKENS_PER_WORD)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text down to at most ``max_tokens`` tokens."""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+            return self.tokenizer.decode(ids, skip_special_tokens=True)
+        return " ".join(text.split()[:int(max_tokens / TOKENS_PER_WORD)])
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\W+", " ", text.lower()).strip()
+
+
+def _message_field(message: Any, field: str) -> Any:
+    # History entries may be ConversationMessage objects or their dicts
+    return message.get(field) if isinstance(message, dict) else getattr(message, field, None)
+
+
+def render_profile(profile: Optional[Dict[str, Any]]) -> str:
+    """Render a profile as compact "field: value" lines, skipping empty fields."""
+    if not profile:
+        return ""
+    if not isinstance(profile, dict):
+        return str(profile)
+    return "\n".join(
+        f"{key.replace('_', ' ')}: {value if isinstance(value, str) else json.dumps(value)}"
+        for key, value in profile.items() if value not in (None, "", [], {})
+    )
+
+
+def render_message(message: Any) -> str:
+    """Render one turn without the JSON-dumped plan assistant messages carry."""
+    role = _message_field(message, "role")
+    if role == "assistant":
+        plan = _message_field(message, "metadata") or {}
+        steps = plan.get("steps") or []
+        text = plan.get("goal") or _message_field(message, "content") or ""
+        if steps:
+            text = f"{text} (first step: {steps[0]})"
+        return " ".join(f"Assistant planned: {text}".split())
+    return " ".join(f"User: {_message_field(message, 'content') or ''}".split())
+
+
+class PromptBuilder:
+    """Assembles planner prompts within a fixed token budget.
+
+    The goal, the profile, the retrieved context and the conversation each
+    get a share of ``budget`` (counted with the model's tokenizer when there
+    is one). Context documents are deduplicated sentence by sentence, and
+    only the most recent messages are quoted; older turns are folded into a
+    running summary that is cached per session and extended incrementally,
+    so a long conversation costs no more than a short one.
+    """
+
+    def __init__(self, template: Any,
+                 counter: Optional[TokenCounter] = None,
+                 budget: int = PROMPT_TOKEN_BUDGET,
+                 recent_messages: int = PROMPT_RECENT_MESSAGES,
+                 summary_tokens: int = PROMPT_SUMMARY_TOKENS,
+                 cache_size: int = PROMPT_SUMMARY_CACHE_SIZE):
+        self.template = template
+        self.counter = counter or TokenCounter()
+        self.budget = budget
+        self.recent_messages = recent_messages
+        self.summary_tokens = summary_tokens
+        self.cache_size = cache_size
+        # session id -> [messages summarized so far, digest lines]
+        self._summaries: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._overhead = self.counter.count(
+            template.format(**{name: "" for name in template.input_variables})
+        )
+
+    def _summary(self, session_id: Optional[str], older: List[Any]) -> str:
+        """Extend the session's cached summary with turns that just aged out."""
+        if not older:
+            return ""
+        with self._lock:
+            cached = self._summaries.get(session_id) if session_id else None
+            if cached is None or cached[0] > len(older):
+                cached = [0, []]
+            for message in older[cached[0]:]:
+                cached[1].append(self.counter.truncate(render_message(message), DIGEST_TOKENS))
+            cached[0] = len(older)
+            # Oldest digests go first once the summary is over its budget
+            while len(cached[1]) > 1 and self.counter.count("\n".join(cached[1])) > self.summary_tokens:
+                cached[1].pop(0)
+            if session_id:
+                self._summaries[session_id] = cached
+                self._summaries.move_to_end(session_id)
+                while len(self._summaries) > self.cache_size:
+                    self._summaries.popitem(last=False)
+            return self.counter.truncate("\n".join(cached[1]), self.summary_tokens)
+
+    def _dedupe_context(self, context: Any) -> List[str]:
+        """Retrieved documents in rank order, without repeated documents or sentences."""
+        if isinstance(context, dict) and "documents" in context:
+            texts = [doc["text"] for doc in context["documents"]]
+        elif context:
+            texts = [context if isinstance(context, str) else json.dumps(context)]
+        else:
+            texts = []
+        seen = set()
+        passages = []
+        for text in texts:
+            fresh = []
+            for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+                key = _normalize(sentence)
+                if key and key not in seen:
+                    seen.add(key)
+                    fresh.append(sentence)
+            if fresh:
+                passages.append(" ".join(fresh))
+        return passages
+
+    def _fit(self, pieces: List[str], budget: int) -> str:
+        """Join pieces in order until the budget runs out, cutting the last one."""
+        kept = []
+        for piece in pieces:
+            cost = self.counter.count(piece)
+            if cost > budget:
+                if budget > DIGEST_TOKENS // 2 or not kept:
+                    kept.append(self.counter.truncate(piece, budget))
+                break
+            kept.append(piece)
+            budget -= cost
+        return "\n".join(piece for piece in kept if piece)
+
+    def history_key(self, history: Optional[List[Any]]) -> Optional[str]:
+        """Fingerprint of the conversation a prompt would quote; None without history."""
+        if not history:
+            return None
+        recent = history[max(len(history) - self.recent_messages, 0):]
+        ids = [str(_message_field(message, "id") or _message_field(message, "content")) for message in recent]
+        # The count stands in for the summarized turns, which precede these ids
+        return hashlib.sha1(f"{len(history)}:{','.join(ids)}".encode("utf-8")).hexdigest()[:16]
+
+    def build(self, goal: str, profile: Optional[Dict[str, Any]], context: Any,
+              history: Optional[List[Any]] = None, session_id: Optional[str] = None) -> str:
+        """Build the prompt; ``history`` is every earlier message, oldest first."""
+        history = history or []
+        available = max(self.budget - self._overhead, 0)
+
+        goal_text = self.counter.truncate(goal, available // 4)
+        available -= self.counter.count(goal_text)
+        profile_text = self.counter.truncate(render_profile(profile), available // 4)
+        available -= self.counter.count(profile_text)
+
+        split = max(len(history) - self.recent_messages, 0)
+        summary = self._summary(session_id, history[:split])
+        recent = [render_message(message) for message in history[split:]]
+        # Conversation gets at most a quarter of what is left; context the rest
+        history_budget = available // 4
+        lines = []
+        if summary:
+            lines.append(self.counter.truncate(f"Earlier: {summary}", history_budget // 2))
+            history_budget -= self.counter.count(lines[0])
+        # Keep the newest turns that fit, in chronological order
+        kept = []
+        for line in reversed(recent):
+            cost = self.counter.count(line)
+            if cost > history_budget:
+                if history_budget >= DIGEST_TOKENS:
+                    kept.insert(0, self.counter.truncate(line, history_budget))
+                break
+            kept.insert(0, line)
+            history_budget -= cost
+        history_text = "\n".join(lines + kept)
+        available -= self.counter.count(history_text)
+
+        context_text = self._fit(self._dedupe_context(context), available)
+        values = {"profile": profile_text, "goal": goal_text, "context": context_text, "history": history_text}
+        return self.template.format(
+            **{name: values.get(name, "") for name in self.template.input_variables}
+        )
@@ -0,0 +1,81 @@
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+import asyncio
+import logging
+import time
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Any]]
+StageCallback = Callable[[str, Any, float], None]
+
+
+class Stage:
+    def __init__(self, name: str, func: StageFunc, depends_on: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+
+
+class StageGraph:
+    """Run async stages concurrently, each one waiting only on its dependencies.
+
+    A stage function receives a dict mapping its dependency names to their
+    results. Per-stage timings (in milliseconds) are available in ``timings``
+    after ``run`` completes. ``on_stage_done`` is called with the stage name,
+    result and duration as soon as each stage finishes.
+    """
+
+    def __init__(self, name: str = "pipeline", on_stage_done: Optional[StageCallback] = None):
+        self.name = name
+        self.on_stage_done = on_stage_done
+        self.stages: Dict[str, Stage] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add_stage(self, name: str, func: StageFunc, depends_on: Iterable[str] = ()) -> "StageGraph":
+        """Register a stage; dependencies must already be registered."""
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already registered")
+        stage = Stage(name, func, depends_on)
+        for dependency in stage.depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = stage
+        return self
+
+    async def _run_stage(self, stage: Stage, tasks: Dict[str, "asyncio.Task"]) -> Any:
+        inputs = {}
+        for dependency in stage.depends_on:
+            inputs[dependency] = await tasks[dependency]
+
+        start = time.perf_counter()
+        try:
+            result = await stage.func(inputs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[stage.name] = round(elapsed * 1000, 2)
+            metrics.observe("stage_duration_seconds", elapsed, stage=stage.name)
+        if self.on_stage_done:
+            self.on_stage_done(stage.name, result, self.timings[stage.name])
+        return result
+
+    async def run(self) -> Dict[str, Any]:
+        """Run every stage and return their results keyed by stage name."""
+        start = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+        # Stages are registered in dependency order, so every dependency's
+        # task exists before the stages that await it
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.ensure_future(self._run_stage(stage, tasks))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except Exception:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        finally:
+            self.timings["total"] = round((time.perf_counter() - start) * 1000, 2)
+            logger.info(f"{self.name} stage timings (ms): {self.timings}")
+
+        return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,93 @@
+from typing import Iterator, List
+import hashlib
+import time
+import numpy as np
+
+PROFILE_TEMPLATE = (
+    "Financial goals: {goal}\n"
+    "Risk tolerance: {risk}\n"
+    "Time horizon: {years} years\n"
+    "Current situation: Earns ${income} per year\n"
+    "Investment preferences: Index funds"
+)
+
+PLAN_TEMPLATE = (
+    "Main goal: {goal}\n"
+    "Steps: Review your budget. Automate monthly savings. Track progress quarterly.\n"
+    "Timeline: {months} months\n"
+    "Estimated costs: ${cost}\n"
+    "Risks: Income disruption. Unexpected expenses.\n"
+    "Recommendations: Keep an emergency fund. Revisit the plan yearly."
+)
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class FakeLLM:
+    """Deterministic stand-in for the seq2seq LLM with configurable latency.
+
+    The completion depends only on the prompt, so runs are reproducible.
+    ``latency_ms`` is paid per call (per batch when batched) and
+    ``per_token_ms`` per streamed chunk.
+    """
+
+    def __init__(self, latency_ms: float = 200.0, per_token_ms: float = 2.0,
+                 supports_batching: bool = False):
+        self.latency_ms = latency_ms
+        self.per_token_ms = per_token_ms
+        self.supports_batching = supports_batching
+        self.calls = 0
+
+    def _complete(self, prompt: str) -> str:
+        digest = _digest(prompt)
+        if "profile information" in prompt:
+            return PROFILE_TEMPLATE.format(
+                goal="Build long-term savings",
+                risk=("low", "moderate", "high")[digest % 3],
+                years=1 + digest % 30,
+                income=30000 + (digest % 100) * 1000
+            )
+        return PLAN_TEMPLATE.format(goal="Reach the stated goal", months=6 + digest % 30, cost=1000 + digest % 9000)
+
+    def invoke(self, prompt: str) -> str:
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        return self._complete(prompt)
+
+    __call__ = invoke
+
+    def batch(self, prompts: List[str]) -> List[str]:
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        return [self._complete(prompt) for prompt in prompts]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        for word in self._complete(prompt).split(" "):
+            time.sleep(self.per_token_ms / 1000)
+            yield word + " "
+
+
+class FakeEmbeddingModel:
+    """Deterministic bag-of-words encoder with the SentenceTransformer interface."""
+
+    def __init__(self, dimensions: int = 384, latency_ms: float = 5.0):
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+
+    def encode(self, texts: List[str], batch_size: int = 32, normalize_embeddings: bool = True,
+               convert_to_numpy: bool = True, show_progress_bar: bool = False) -> np.ndarray:
+        batches = max(1, -(-len(texts) // batch_size))
+        time.sleep(self.latency_ms * batches / 1000)
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                vectors[row, _digest(token) % self.dimensions] += 1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors /= norms
+        return vectors
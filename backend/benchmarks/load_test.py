@@ -0,0 +1,302 @@
+"""End-to-end load test for PersonalAssistant and the /ws endpoint.
+
+N simulated users each send a few turns concurrently, either straight
+through ``PersonalAssistant.process`` or over ``/ws``. The LLM and the
+embedding model are deterministic fakes with configurable latency, so the
+run is offline and reproducible; everything else (executor, vector store,
+response cache, session storage) is the real code path, with its data in
+a temporary directory.
+
+Run from backend/:
+
+    python -m benchmarks.load_test --users 20 --turns 3
+    python -m benchmarks.load_test --mode ws --stream
+    python -m benchmarks.load_test --save-baseline
+
+The report covers throughput, p50/p95/p99 latency per stage and per turn,
+memory growth per session and startup time. Results are compared with
+benchmarks/baseline.json (record one with ``--save-baseline`` on the
+machine that runs the check); the exit status is 1 when there is no
+baseline or when throughput or a p95 latency regressed beyond
+``--tolerance``.
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+GOALS = [
+    "I want to save ${amount} for a house deposit in {years} years",
+    "Help me pay off ${amount} of credit card debt within {years} years",
+    "I am {age} and want to retire early with moderate risk",
+    "How should I invest ${amount} for my child's education over {years} years",
+    "I earn ${amount} a year and want to build an emergency fund",
+    "I want to start investing in index funds with low risk"
+]
+
+# Absolute slack on p95 comparisons so millisecond-scale stages don't flap
+P95_SLACK_MS = 5.0
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "count": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+            "count": len(values)}
+
+
+def user_turns(user: int, turns: int, seed: int) -> List[str]:
+    """Deterministic goals for one simulated user."""
+    rng = random.Random(seed * 100003 + user)
+    return [
+        rng.choice(GOALS).format(
+            amount=rng.randrange(5, 200) * 1000,
+            years=rng.randrange(1, 30),
+            age=rng.randrange(22, 60)
+        )
+        for _ in range(turns)
+    ]
+
+
+class RunRecorder:
+    """Collects per-turn and per-stage latencies from concurrent users."""
+
+    def __init__(self):
+        self.turn_ms: List[float] = []
+        self.stage_ms: Dict[str, List[float]] = {}
+        self.errors: List[str] = []
+        self.session_ids = set()
+        self._lock = threading.Lock()
+
+    def record(self, response: Dict[str, Any], elapsed_ms: float):
+        with self._lock:
+            if not response.get("success"):
+                self.errors.append(str(response.get("error") or response.get("message")))
+                return
+            self.turn_ms.append(elapsed_ms)
+            data = response["data"]
+            self.session_ids.add(data["session_id"])
+            for stage, duration_ms in data.get("timings", {}).items():
+                self.stage_ms.setdefault(stage, []).append(duration_ms)
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        return {
+            "turns": len(self.turn_ms),
+            "errors": len(self.errors),
+            "sample_errors": self.errors[:3],
+            "wall_seconds": round(wall_seconds, 3),
+            "throughput_rps": round(len(self.turn_ms) / wall_seconds, 2) if wall_seconds else 0.0,
+            "turn_ms": percentiles(self.turn_ms),
+            "stages_ms": {stage: percentiles(values) for stage, values in sorted(self.stage_ms.items())}
+        }
+
+
+def install_fakes(args: argparse.Namespace, workdir: str):
+    """Swap the model backends for fakes and point storage at ``workdir``."""
+    os.environ["CHROMA_PERSIST_DIR"] = os.path.join(workdir, "chroma")
+    os.environ.setdefault("WARMUP_ON_STARTUP", "false")
+
+    from services.model_registry import registry
+    from services.session_manager import SessionManager
+    from rag.embeddings import EmbeddingService
+    from benchmarks.fakes import FakeEmbeddingModel, FakeLLM
+
+    registry.set("llm", FakeLLM(
+        latency_ms=args.llm_latency_ms,
+        per_token_ms=args.token_latency_ms,
+        supports_batching=args.batching
+    ))
+    registry.set("embedding_service", EmbeddingService(
+        "fake-embeddings",
+        model=FakeEmbeddingModel(latency_ms=args.embed_latency_ms)
+    ))
+    registry.set("session_manager", SessionManager(os.path.join(workdir, "sessions")))
+    # Word-based token estimates; nothing is downloaded
+    registry.set("tokenizer", None)
+
+
+def measure_startup() -> Dict[str, Any]:
+    """Time importing the app and loading every component it warms up."""
+    from services.model_registry import get_rss_mb, registry
+
+    start = time.perf_counter()
+    import main
+    import_ms = (time.perf_counter() - start) * 1000
+    for name in main.WARMUP_COMPONENTS:
+        registry.get(name)
+    ready_ms = (time.perf_counter() - start) * 1000
+    components = registry.get_status()["components"]
+    return {
+        "import_ms": round(import_ms, 2),
+        "ready_ms": round(ready_ms, 2),
+        "rss_mb": get_rss_mb(),
+        "components_ms": {name: status.get("load_time_ms") for name, status in components.items()}
+    }
+
+
+async def run_assistant(users: int, turns: int, seed: int) -> Dict[str, Any]:
+    """Drive PersonalAssistant.process directly with concurrent users."""
+    from services.model_registry import registry
+    assistant = registry.get("personal_assistant")
+    recorder = RunRecorder()
+
+    async def simulate(user: int):
+        session_id: Optional[str] = None
+        for text in user_turns(user, turns, seed):
+            start = time.perf_counter()
+            response = await assistant.process({"text": text, "session_id": session_id})
+            recorder.record(response, (time.perf_counter() - start) * 1000)
+            if response.get("success"):
+                session_id = response["data"]["session_id"]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(simulate(user) for user in range(users)))
+    return recorder.report(time.perf_counter() - start)
+
+
+def run_ws(client, users: int, turns: int, seed: int, stream: bool) -> Dict[str, Any]:
+    """Drive the /ws endpoint with one connection (and thread) per user."""
+    recorder = RunRecorder()
+
+    def simulate(user: int):
+        session_id: Optional[str] = None
+        with client.websocket_connect("/ws") as websocket:
+            for text in user_turns(user, turns, seed):
+                start = time.perf_counter()
+                websocket.send_json({"text": text, "session_id": session_id, "stream": stream})
+                response = websocket.receive_json()
+                # Streaming clients get stage and token events before the plan
+                while stream and response.get("type") != "plan":
+                    response = websocket.receive_json()
+                recorder.record(response, (time.perf_counter() - start) * 1000)
+                if response.get("success"):
+                    session_id = response["data"]["session_id"]
+
+    threads = [threading.Thread(target=simulate, args=(user,)) for user in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.perf_counter() - start)
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """List the regressions of ``report`` against ``baseline``."""
+    regressions = []
+    for mode, current in report["runs"].items():
+        previous = baseline.get("runs", {}).get(mode)
+        if not previous:
+            continue
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{mode}: throughput {current['throughput_rps']} rps < baseline {previous['throughput_rps']} rps"
+            )
+        series = {"turn": (current["turn_ms"], previous["turn_ms"])}
+        for stage, stats in current["stages_ms"].items():
+            if stage in previous["stages_ms"]:
+                series[f"stage {stage}"] = (stats, previous["stages_ms"][stage])
+        for name, (stats, old) in series.items():
+            limit = old["p95"] * (1 + tolerance) + P95_SLACK_MS
+            if stats["p95"] > limit:
+                regressions.append(f"{mode}: {name} p95 {stats['p95']}ms > baseline {old['p95']}ms")
+        growth, old_growth = current.get("rss_kb_per_session"), previous.get("rss_kb_per_session")
+        if growth is not None and old_growth and growth > old_growth * (1 + tolerance) + 64:
+            regressions.append(f"{mode}: memory {growth}KB/session > baseline {old_growth}KB/session")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load-test the assistant with fake model backends.")
+    parser.add_argument("--mode", choices=["assistant", "ws", "both"], default="both")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per user")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--token-latency-ms", type=float, default=2.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0)
+    parser.add_argument("--batching", action="store_true", help="Let the fake LLM accept batched prompts")
+    parser.add_argument("--stream", action="store_true", help="Request streamed responses over /ws")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--output", help="Also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="coach-bench-")
+    try:
+        install_fakes(args, workdir)
+        from fastapi.testclient import TestClient
+        from services.model_registry import get_rss_mb, registry
+
+        report: Dict[str, Any] = {
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("baseline", "save_baseline", "output", "tolerance")},
+            "startup": measure_startup(),
+            "runs": {}
+        }
+        modes = ["assistant", "ws"] if args.mode == "both" else [args.mode]
+        import main as app_main
+        # Both modes share the app's event loop, as they would in one worker
+        with TestClient(app_main.app) as client:
+            for mode in modes:
+                # Plans cached by the previous mode would flatter this one
+                registry.get("response_cache").invalidate()
+                rss_before = get_rss_mb()
+                if mode == "assistant":
+                    result = client.portal.call(run_assistant, args.users, args.turns, args.seed)
+                else:
+                    result = run_ws(client, args.users, args.turns, args.seed, args.stream)
+                # Every user opens a new session, so growth is attributed per user
+                result["rss_kb_per_session"] = round((get_rss_mb() - rss_before) * 1024 / max(args.users, 1), 1)
+                report["runs"][mode] = result
+
+        report["response_cache"] = registry.get("response_cache").get_stats()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        # A check with nothing to compare against must not pass silently
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config") != report["config"]:
+        print("Warning: baseline was recorded with a different configuration")
+    regressions = compare(report, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("No regressions against the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,27 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+import time
+
+STARTUP_BEGAN = time.perf_counter()
+
+from fastapi import FastAPI, WebSocket, HTTPException, Query, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from models.schemas import UserGoal, AgentResponse
-from agents.personal_assistant import PersonalAssistant
+import asyncio
+import codecs
 import json
 import logging
-from typing import List, Dict, Any
+import os
+from typing import List, Dict, Any, Optional
+from datetime import datetime
 from models.user_session import UserSession
-from services.session_manager import SessionManager
+from services.model_registry import registry
+from services.metrics import metrics, install_trace_logging, set_trace_id
+from services.ws_pipeline import AdmissionController, ConnectionPipeline
+from rag.ingest import FORMATS, detect_format, ingest_advice, read_advice_records
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
+install_trace_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Financial Coach API")
@@ -23,77 +35,151 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize the personal assistant
-assistant = PersonalAssistant()
-session_manager = SessionManager()
+# Models, clients and the personal assistant are shared through the registry and
+# loaded lazily: by the background warm-up below, or on first use
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+WARMUP_COMPONENTS = ["llm", "embedding_service", "chroma_client", "rag_pipeline", "personal_assistant"]
+session_manager = registry.get("session_manager")
+# Which worker holds each session's WebSocket (CONNECTION_BACKEND=sqlite shares
+# it across workers)
+connections = registry.get("connection_registry")
+
+@app.on_event("startup")
+async def start_warm_up():
+    logger.info(f"API accepting traffic {round((time.perf_counter() - STARTUP_BEGAN) * 1000, 2)}ms after import")
+    await connections.start()
+    if WARMUP_ON_STARTUP:
+        app.state.warm_up_task = asyncio.create_task(registry.warm_up(WARMUP_COMPONENTS))
+
+@app.on_event("shutdown")
+async def stop_connections():
+    await connections.stop()
 
-# Store active WebSocket connections
-active_connections: Dict[str, WebSocket] = {}
+# Requests in flight across every /ws connection of this worker
+admission = AdmissionController()
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    session_id = None
+    session_ids = set()
     
-    try:
-        while True:
-            # Receive message
-            data = await websocket.receive_text()
-            
-            try:
-                message = json.loads(data)
-                session_id = message.get("session_id")
-                
-                # Store connection
-                if session_id:
-                    active_connections[session_id] = websocket
-                
-                # Process message through Personal Assistant
-                response = await assistant.process(message)
-                
-                # Send response back to client
-                await websocket.send_json(response)
-                
-            except json.JSONDecodeError:
-                await websocket.send_json({
-                    "success": False,
-                    "message": "Invalid JSON format",
-                    "data": None
-                })
-                
-    except WebSocketDisconnect:
+    async def handle(message: Dict[str, Any], send):
+        session_id = message.get("session_id")
+        
+        # Store connection
         if session_id:
-            active_connections.pop(session_id, None)
-            logger.info(f"Client disconnected: {session_id}")
+            session_ids.add(session_id)
+            connections.register(session_id, websocket)
+            set_trace_id(session_id)
+        
+        # Process message through Personal Assistant
+        assistant = await registry.aget("personal_assistant")
+        if message.get("stream"):
+            # Stage progress and planner tokens first, then the final plan
+            async for event in assistant.process_stream(message):
+                await send(event)
+            return
+        response = await assistant.process(message)
+        if not session_id and response.get("success"):
+            # A session was created for this turn; route later sends here
+            session_id = response["data"]["session_id"]
+            session_ids.add(session_id)
+            connections.register(session_id, websocket)
+        
+        # Send response back to client
+        await send(response)
+    
+    try:
+        await ConnectionPipeline(websocket, handle, admission).run()
     except Exception as e:
         logger.error(f"Error in WebSocket connection: {str(e)}")
-        if session_id:
-            active_connections.pop(session_id, None)
-        await websocket.close()
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+    finally:
+        for session_id in session_ids:
+            connections.unregister(session_id, websocket)
+        if session_ids:
+            logger.info(f"Client disconnected: {', '.join(sorted(session_ids))}")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "Financial Coach API is running"}
+    """Liveness: the process is up, whether or not the models have loaded."""
+    return {
+        "status": "healthy",
+        "message": "Financial Coach API is running",
+        "ready": registry.is_loaded("personal_assistant")
+    }
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: the models are loaded and chat traffic can be served."""
+    if not registry.is_loaded("personal_assistant"):
+        raise HTTPException(status_code=503, detail="Models are still loading")
+    return {"status": "ready", "components": registry.get_status()["components"]}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Stage latencies, token counts and cache hits in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/models")
+async def get_model_status():
+    """Get load state and memory usage of the shared models and clients."""
+    return registry.get_status()
+
+@app.get("/api/cache")
+async def get_cache_stats():
+    """Get hit/miss statistics of the response cache."""
+    response_cache = await registry.aget("response_cache")
+    return response_cache.get_stats()
 
 # Knowledge Base Management Endpoints
 @app.post("/api/advice")
 async def add_advice(text: str, topic: str, category: str):
     """Add new financial advice to the knowledge base."""
+    rag_pipeline = await registry.aget("rag_pipeline")
     success = rag_pipeline.add_advice(text, topic, category)
     if not success:
         raise HTTPException(status_code=500, detail="Failed to add advice")
     return {"message": "Advice added successfully"}
 
+@app.post("/api/advice/bulk")
+async def bulk_add_advice(file: UploadFile = File(...),
+                          format: Optional[str] = None,
+                          batch_size: int = Query(512, ge=1, le=5000)):
+    """Ingest a JSONL or CSV file of advice, embedding it in batches."""
+    fmt = format or detect_format(file.filename)
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail="Advice file must be JSONL or CSV")
+    rag_pipeline = await registry.aget("rag_pipeline")
+    # The upload is read line by line on a worker thread, never held in memory whole.
+    # Lines are decoded as they come: before Python 3.11 the spooled upload file
+    # can't be wrapped in a TextIOWrapper
+    stream = codecs.iterdecode(file.file, "utf-8")
+    loop = asyncio.get_running_loop()
+    stats = await loop.run_in_executor(
+        None, lambda: ingest_advice(rag_pipeline, read_advice_records(stream, fmt), batch_size)
+    )
+    return {"message": "Advice ingested successfully", **stats}
+
 @app.get("/api/advice/category/{category}")
-async def get_advice_by_category(category: str) -> List[Dict[str, Any]]:
-    """Get financial advice by category."""
-    advice = rag_pipeline.get_advice_by_category(category)
+async def get_advice_by_category(category: str,
+                                 offset: int = Query(0, ge=0),
+                                 limit: int = Query(100, ge=1, le=500)) -> List[Dict[str, Any]]:
+    """Get a page of financial advice by category."""
+    rag_pipeline = await registry.aget("rag_pipeline")
+    advice = rag_pipeline.get_advice_by_category(category, offset, limit)
     return advice
 
 @app.get("/api/advice/topic/{topic}")
-async def get_advice_by_topic(topic: str) -> List[Dict[str, Any]]:
-    """Get financial advice by topic."""
-    advice = rag_pipeline.get_advice_by_topic(topic)
+async def get_advice_by_topic(topic: str,
+                              offset: int = Query(0, ge=0),
+                              limit: int = Query(100, ge=1, le=500)) -> List[Dict[str, Any]]:
+    """Get a page of financial advice by topic."""
+    rag_pipeline = await registry.aget("rag_pipeline")
+    advice = rag_pipeline.get_advice_by_topic(topic, offset, limit)
     return advice
 
 @app.get("/sessions/{session_id}")
@@ -104,16 +190,25 @@ async def get_session(session_id: str):
     return session.dict()
 
 @app.get("/sessions")
-async def list_sessions():
-    return {"sessions": [session.dict() for session in session_manager.get_active_sessions()]}
+async def list_sessions(offset: int = Query(0, ge=0),
+                        limit: int = Query(50, ge=1, le=500),
+                        active_since: Optional[datetime] = None):
+    """List session summaries, most recently active first."""
+    return session_manager.list_sessions(offset, limit, active_since)
 
 @app.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
     session = session_manager.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    # Close WebSocket connection if active
-    if session_id in active_connections:
-        await active_connections[session_id].close()
-        active_connections.pop(session_id)
+    # Close WebSocket connection if active, on whichever worker holds it
+    await connections.close(session_id)
+    session_manager.delete_session(session_id)
     return {"message": "Session deleted successfully"}
+
+@app.post("/sessions/{session_id}/notify")
+async def notify_session(session_id: str, payload: Dict[str, Any]):
+    """Push a JSON payload to the session's WebSocket, on whichever worker holds it."""
+    if not await connections.send(session_id, payload):
+        raise HTTPException(status_code=404, detail="Session is not connected")
+    return {"message": "Payload sent"}
@@ -0,0 +1,292 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+from array import array
+from datetime import datetime, timedelta
+from pydantic_core import core_schema
+import atexit
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import uuid
+import weakref
+import zlib
+
+# Messages kept in memory per session; older ones are spilled to disk
+HISTORY_MEMORY_MESSAGES = int(os.getenv("HISTORY_MEMORY_MESSAGES", "40"))
+# Spill in batches of this many so appends don't touch disk every turn
+HISTORY_SPILL_BATCH = int(os.getenv("HISTORY_SPILL_BATCH", "20"))
+# Plan payloads at least this large are kept zlib-compressed
+HISTORY_COMPRESS_MIN_BYTES = int(os.getenv("HISTORY_COMPRESS_MIN_BYTES", "256"))
+HISTORY_SPILL_DIR = os.getenv("HISTORY_SPILL_DIR", "")
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_spill_dir: Optional[str] = None
+
+
+def _get_spill_dir() -> str:
+    global _spill_dir
+    if _spill_dir is None:
+        if HISTORY_SPILL_DIR:
+            os.makedirs(HISTORY_SPILL_DIR, exist_ok=True)
+            _spill_dir = HISTORY_SPILL_DIR
+        else:
+            # Private to this process (mode 0700) and removed when it exits
+            _spill_dir = tempfile.mkdtemp(prefix="history-spill-")
+            atexit.register(shutil.rmtree, _spill_dir, ignore_errors=True)
+    return _spill_dir
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class _Record:
+    """One message, packed: 16-byte id, integer timestamp, interned role, and
+    for assistant turns the plan once (compressed when large) instead of a
+    dict plus its JSON copy in ``content``."""
+
+    __slots__ = ("id", "timestamp", "role", "content", "plan")
+
+    def __init__(self, message_id: Union[bytes, str], timestamp: Union[int, datetime], role: str,
+                 content: Optional[str], plan: Union[bytes, str, None]):
+        self.id = message_id
+        self.timestamp = timestamp
+        self.role = role
+        self.content = content
+        self.plan = plan
+
+    @classmethod
+    def pack(cls, message_id: str, timestamp: datetime, role: str, content: str,
+             metadata: Optional[Dict[str, Any]]) -> "_Record":
+        try:
+            packed_id: Union[bytes, str] = uuid.UUID(message_id).bytes
+            if str(uuid.UUID(bytes=packed_id)) != message_id:
+                packed_id = message_id
+        except ValueError:
+            packed_id = message_id
+        # Naive timestamps (the default) fit in an int; aware ones are kept as-is
+        packed_time = timestamp if timestamp.tzinfo else (timestamp - _EPOCH) // _MICROSECOND
+        plan = None
+        if metadata is not None:
+            # Non-JSON values (e.g. datetimes) become strings, as the stores save them
+            plan = json.dumps(metadata, default=str)
+            if content == plan:
+                # The assistant's content is the plan's JSON; keep it once
+                content = None
+            if len(plan) >= HISTORY_COMPRESS_MIN_BYTES:
+                plan = zlib.compress(plan.encode("utf-8"))
+        return cls(packed_id, packed_time, sys.intern(role), content, plan)
+
+    def unpack(self) -> Dict[str, Any]:
+        plan = self.plan
+        if isinstance(plan, bytes):
+            plan = zlib.decompress(plan).decode("utf-8")
+        return {
+            "id": str(uuid.UUID(bytes=self.id)) if isinstance(self.id, bytes) else self.id,
+            "timestamp": self.timestamp if isinstance(self.timestamp, datetime) else _EPOCH + self.timestamp * _MICROSECOND,
+            "role": self.role,
+            "content": self.content if self.content is not None else plan,
+            "metadata": json.loads(plan) if plan is not None else None
+        }
+
+    def __getstate__(self):
+        return (self.id, self.timestamp, self.role, self.content, self.plan)
+
+    def __setstate__(self, state):
+        self.id, self.timestamp, self.role, self.content, self.plan = state
+
+
+class ConversationHistory:
+    """Compact, list-like conversation history.
+
+    Messages are stored as slotted ``_Record`` objects and turned back into
+    ConversationMessage objects when read. Only the newest ``memory_limit``
+    records stay in memory; older ones are appended to a per-history spill
+    file (removed when the history is garbage collected) and read back on
+    demand. Slicing returns a lazy view, so taking ``history[:-1]`` or
+    the last few messages never loads spilled turns.
+    """
+
+    def __init__(self, messages: Iterable[Any] = (), memory_limit: int = HISTORY_MEMORY_MESSAGES):
+        self.memory_limit = memory_limit
+        self._records: List[_Record] = []
+        self._spilled = 0
+        # Byte offset of each spilled record, plus the end of the last one
+        self._offsets = array("Q", [0])
+        self._spill_path: Optional[str] = None
+        for message in messages:
+            self.append(message)
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self._message(i) for i in range(start, stop, step)]
+            return HistoryView(self, start, max(stop, start))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("conversation history index out of range")
+        return self._message(index)
+
+    def __iter__(self) -> Iterator[Any]:
+        return self._iter_range(0, len(self))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ConversationHistory, HistoryView, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ConversationHistory({len(self)} messages, {self._spilled} spilled)"
+
+    def add(self, role: str, content: str, metadata: Optional[Dict[str, Any]] = None,
+            message_id: Optional[str] = None, timestamp: Optional[datetime] = None):
+        self._push(_Record.pack(
+            message_id or str(uuid.uuid4()), timestamp or datetime.now(), role, content, metadata
+        ))
+
+    def _push(self, record: _Record):
+        self._records.append(record)
+        if len(self._records) > self.memory_limit + HISTORY_SPILL_BATCH:
+            self._spill(len(self._records) - self.memory_limit)
+
+    def append(self, message: Any):
+        """Append a ConversationMessage (or a dict of its fields)."""
+        from models.user_session import ConversationMessage
+        if not isinstance(message, ConversationMessage):
+            message = ConversationMessage(**message)
+        self.add(message.role, message.content, message.metadata, message.id, message.timestamp)
+
+    def _message(self, index: int):
+        if index >= self._spilled:
+            record = self._records[index - self._spilled]
+        else:
+            record = next(self._read_spilled(index, index + 1))
+        return _to_message(record)
+
+    def _iter_range(self, start: int, stop: int) -> Iterator[Any]:
+        if start < min(stop, self._spilled):
+            for record in self._read_spilled(start, min(stop, self._spilled)):
+                yield _to_message(record)
+            start = self._spilled
+        for index in range(start, stop):
+            yield _to_message(self._records[index - self._spilled])
+
+    def _spill(self, count: int):
+        if self._spill_path is None:
+            fd, self._spill_path = tempfile.mkstemp(prefix="session-", suffix=".history", dir=_get_spill_dir())
+            os.close(fd)
+            weakref.finalize(self, _remove, self._spill_path)
+        with open(self._spill_path, "ab") as f:
+            for record in self._records[:count]:
+                f.write(pickle.dumps(record.__getstate__(), protocol=pickle.HIGHEST_PROTOCOL))
+                self._offsets.append(f.tell())
+        del self._records[:count]
+        self._spilled += count
+
+    def _read_spilled(self, start: int, stop: int) -> Iterator[_Record]:
+        with open(self._spill_path, "rb") as f:
+            f.seek(self._offsets[start])
+            for index in range(start, stop):
+                record = _Record.__new__(_Record)
+                record.__setstate__(pickle.loads(f.read(self._offsets[index + 1] - self._offsets[index])))
+                yield record
+
+    def _all_records(self) -> Iterator[_Record]:
+        if self._spilled:
+            yield from self._read_spilled(0, self._spilled)
+        yield from list(self._records)
+
+    # The spill file belongs to one history (its finalizer deletes it), so
+    # copies and unpickled histories write their own instead of sharing it
+    def __copy__(self) -> "ConversationHistory":
+        clone = ConversationHistory(memory_limit=self.memory_limit)
+        for record in self._all_records():
+            # Records are never modified, so the copy can share them
+            clone._push(record)
+        return clone
+
+    def __deepcopy__(self, memo) -> "ConversationHistory":
+        return self.__copy__()
+
+    def __getstate__(self):
+        return {
+            "memory_limit": self.memory_limit,
+            "records": [record.__getstate__() for record in self._all_records()]
+        }
+
+    def __setstate__(self, state):
+        self.__init__(memory_limit=state["memory_limit"])
+        for fields in state["records"]:
+            record = _Record.__new__(_Record)
+            record.__setstate__(fields)
+            self._push(record)
+
+    def to_list(self, mode: str = "python") -> List[Dict[str, Any]]:
+        return [message.model_dump(mode=mode) for message in self]
+
+    @classmethod
+    def _validate(cls, value: Any) -> "ConversationHistory":
+        if isinstance(value, ConversationHistory):
+            return value
+        if isinstance(value, (list, tuple, HistoryView)):
+            return cls(value)
+        raise TypeError("conversation history must be a list of messages")
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        return core_schema.no_info_plain_validator_function(
+            cls._validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda history, info: history.to_list(info.mode),
+                info_arg=True
+            )
+        )
+
+
+class HistoryView:
+    """A read-only range of a ConversationHistory, loaded as it is read."""
+
+    def __init__(self, history: ConversationHistory, start: int, stop: int):
+        self._history = history
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return HistoryView(self._history, self._start + start, self._start + max(stop, start))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("conversation history index out of range")
+        return self._history[self._start + index]
+
+    def __iter__(self) -> Iterator[Any]:
+        return self._history._iter_range(self._start, self._stop)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ConversationHistory, HistoryView, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+
+def _to_message(record: _Record):
+    from models.user_session import ConversationMessage
+    # Built from our own packed fields, so validation can be skipped
+    return ConversationMessage.model_construct(**record.unpack())
@@ -13,6 +13,13 @@ class FinancialPlan(BaseModel):
     risks: List[str] = []
     recommendations: List[str] = []
 
+class UserProfile(BaseModel):
+    financial_goals: str = ""
+    risk_tolerance: str = ""
+    time_horizon: str = ""
+    current_situation: str = ""
+    investment_preferences: str = ""
+
 class AgentResponse(BaseModel):
     success: bool
     message: str
@@ -1,33 +1,70 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from models.conversation_history import ConversationHistory
 import uuid
 
+# Profile versions kept per session; older ones are dropped
+MAX_PROFILE_VERSIONS = 20
+
 class ConversationMessage(BaseModel):
-    id: str = str(uuid.uuid4())
-    timestamp: datetime = datetime.now()
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    timestamp: datetime = Field(default_factory=datetime.now)
     role: str  # "user" or "assistant"
     content: str
     metadata: Optional[Dict[str, Any]] = None
 
+class ProfileVersion(BaseModel):
+    version: int
+    timestamp: datetime = Field(default_factory=datetime.now)
+    source: str  # "rules" or "llm"
+    # Fields that changed and their new values (None when a field was removed)
+    changes: Dict[str, Any]
+    confidence: Dict[str, float] = {}
+
 class UserSession(BaseModel):
-    id: str = str(uuid.uuid4())
-    created_at: datetime = datetime.now()
-    last_active: datetime = datetime.now()
-    conversation_history: List[ConversationMessage] = []
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    created_at: datetime = Field(default_factory=datetime.now)
+    last_active: datetime = Field(default_factory=datetime.now)
+    # Compact list-like store; reads yield ConversationMessage objects
+    conversation_history: ConversationHistory = Field(default_factory=ConversationHistory)
     user_profile: Optional[Dict[str, Any]] = None
+    profile_history: List[ProfileVersion] = []
     preferences: Optional[Dict[str, Any]] = None
+    # Saves so far; stores reject a save made from an out-of-date copy
+    version: int = 0
     
-    def add_message(self, role: str, content: str, metadata: Optional[Dict[str, Any]] = None):
-        message = ConversationMessage(role=role, content=content, metadata=metadata)
-        self.conversation_history.append(message)
+    def add_message(self, role: str, content: str, metadata: Optional[Dict[str, Any]] = None,
+                    timestamp: Optional[datetime] = None):
+        self.conversation_history.add(role, content, metadata, timestamp=timestamp)
         self.last_active = datetime.now()
     
     def get_recent_messages(self, limit: int = 5) -> List[ConversationMessage]:
-        return self.conversation_history[-limit:]
+        return list(self.conversation_history[-limit:])
+    
+    @property
+    def profile_version(self) -> int:
+        return self.profile_history[-1].version if self.profile_history else 0
     
-    def update_profile(self, profile_data: Dict[str, Any]):
+    def update_profile(self, profile_data: Dict[str, Any], source: str = "llm",
+                       confidence: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """Replace the profile, recording what changed as a new version."""
+        previous = self.user_profile or {}
+        changes = {
+            key: profile_data.get(key)
+            for key in set(previous) | set(profile_data)
+            if previous.get(key) != profile_data.get(key)
+        }
         self.user_profile = profile_data
+        if changes:
+            self.profile_history.append(ProfileVersion(
+                version=self.profile_version + 1,
+                source=source,
+                changes=changes,
+                confidence={key: value for key, value in (confidence or {}).items() if key in changes}
+            ))
+            del self.profile_history[:-MAX_PROFILE_VERSIONS]
+        return changes
     
     def update_preferences(self, preferences: Dict[str, Any]):
         self.preferences = preferences 
\ No newline at end of file
@@ -0,0 +1,91 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import math
+import re
+import threading
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have i in is it my of on or should "
+    "that the their this to want was what when with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; "401(k)" becomes "401k" so product names match."""
+    text = re.sub(r"(?<=\w)\((\w+)\)", r"\1", text.lower())
+    return [token for token in re.findall(r"[a-z0-9]+", text) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring.
+
+    Documents can be added and removed at any time; corpus statistics are
+    kept incrementally, so scores always reflect the current contents.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {doc id: term frequency}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Dict[str, int]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def add(self, doc_id: str, text: str):
+        """Index a document, replacing any previous version with the same id."""
+        terms: Dict[str, int] = {}
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + 1
+        with self._lock:
+            self._remove(doc_id)
+            self._doc_terms[doc_id] = terms
+            self._doc_lengths[doc_id] = sum(terms.values())
+            self._total_length += self._doc_lengths[doc_id]
+            for term, frequency in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = frequency
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query: str, k: int = 10,
+               allow: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, float]]:
+        """Return up to ``k`` (doc id, score) pairs, best first.
+
+        Only documents sharing a term with the query are scored; ``allow``
+        filters candidates by id.
+        """
+        query_terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._doc_terms)
+            if not count or not query_terms:
+                return []
+            average_length = self._total_length / count
+            scores: Dict[str, float] = {}
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    if allow is not None and not allow(doc_id):
+                        continue
+                    length = self._doc_lengths[doc_id]
+                    norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -0,0 +1,111 @@
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+import re
+import threading
+import numpy as np
+from services.metrics import metrics
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a query so trivially different phrasings share a cache entry."""
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+class EmbeddingService:
+    """Sentence-transformer embeddings shared by the vector store and queries.
+
+    Instances are valid Chroma embedding functions. Documents are encoded in
+    batches; query embeddings are kept in an LRU cache keyed by the
+    normalized query text. With ``quantize=True`` vectors are rounded to int8
+    per-vector scale, which is also how cached query vectors are held, cutting
+    cache memory by 4x.
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2",
+                 batch_size: int = 64,
+                 normalize: bool = True,
+                 quantize: bool = False,
+                 cache_size: int = 2048,
+                 model: Optional[Any] = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.quantize = quantize
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._model = model
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def _encode(self, texts: List[str], kind: str) -> np.ndarray:
+        with metrics.timer("embedding_seconds", kind=kind):
+            vectors = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                normalize_embeddings=self.normalize,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        return np.asarray(vectors, dtype=np.float32)
+
+    @staticmethod
+    def _quantize(vectors: np.ndarray):
+        scale = np.abs(vectors).max(axis=-1, keepdims=True) / 127.0
+        scale[scale == 0] = 1.0
+        return np.round(vectors / scale).astype(np.int8), scale.astype(np.float32)
+
+    @staticmethod
+    def _dequantize(quantized: np.ndarray, scale: np.ndarray) -> np.ndarray:
+        return quantized.astype(np.float32) * scale
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        # Chroma's EmbeddingFunction protocol requires the argument name "input"
+        return self.embed_documents(input)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents in batches."""
+        if not texts:
+            return []
+        vectors = self._encode(list(texts), "documents")
+        if self.quantize:
+            vectors = self._dequantize(*self._quantize(vectors))
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query, reusing the cached vector for repeated queries."""
+        key = normalize_query(text)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+        metrics.inc("cache_requests_total", cache="query_embedding", result="miss" if cached is None else "hit")
+        if cached is None:
+            vector = self._encode([key], "query")
+            cached = self._quantize(vector) if self.quantize else vector
+            with self._lock:
+                self.misses += 1
+                self._cache[key] = cached
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        vector = self._dequantize(*cached) if self.quantize else cached
+        return vector[0].tolist()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get query cache statistics."""
+        return {
+            "model": self.model_name,
+            "cache_size": len(self._cache),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses
+        }
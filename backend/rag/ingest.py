@@ -0,0 +1,189 @@
+"""Bulk ingestion of advice files into the knowledge base.
+
+Records are streamed from JSONL (one ``{"text", "topic", "category", ...}``
+object per line, or ``{"text", "metadata": {...}}``) or CSV (a header row
+with at least text, topic and category). Long texts are split into chunks,
+every chunk gets a content-hash id, and chunks are embedded and upserted in
+large batches; chunks already stored are skipped without being embedded.
+
+    python -m rag.ingest advice.jsonl [--format csv] [--batch-size 512]
+
+The CLI writes to the Chroma server at CHROMA_HOST, or else to the store at
+CHROMA_PERSIST_DIR; a running server picks up the new documents for
+category/topic and BM25 lookups within RAG_INDEX_REFRESH_SECONDS, or on
+restart when that is 0 (vector retrieval sees them immediately). The server's ``POST /api/advice/bulk`` endpoint
+ingests an uploaded file into the live pipeline.
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import time
+from .knowledge_base import get_advice_id
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("jsonl", "csv")
+REQUIRED_FIELDS = ("topic", "category")
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    """Guess the file format from its extension."""
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    if extension in ("csv", "tsv"):
+        return "csv"
+    return None
+
+
+def read_advice_records(stream: Iterable[str], fmt: str) -> Iterator[Dict[str, Any]]:
+    """Yield raw records from JSONL or CSV lines without loading them all.
+
+    Lines that are not valid JSON are yielded as ``{"error": ...}`` so the
+    caller can count them and keep going.
+    """
+    if fmt == "jsonl":
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {"error": f"line {line_number}: {str(e)}"}
+    elif fmt == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        raise ValueError(f"Unsupported advice format: {fmt}")
+
+
+def _metadata_value(value: Any) -> Any:
+    # Chroma metadata values must be scalars
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+def parse_advice(record: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Split a record into text and metadata, or None if it is unusable."""
+    if not isinstance(record, dict) or "error" in record:
+        return None
+    text = str(record.get("text") or "").strip()
+    fields = record.get("metadata") if isinstance(record.get("metadata"), dict) else record
+    metadata = {
+        key: _metadata_value(value)
+        for key, value in fields.items()
+        if key not in ("text", "metadata") and value not in (None, "")
+    }
+    if not text or any(field not in metadata for field in REQUIRED_FIELDS):
+        return None
+    return text, metadata
+
+
+def chunk_text(text: str, max_chars: int = 1000) -> List[str]:
+    """Split text into chunks of at most ``max_chars``, on sentence boundaries where possible."""
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return [text]
+    chunks: List[str] = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        # A single sentence longer than a chunk is cut into fixed windows
+        while len(sentence) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:max_chars])
+            sentence = sentence[max_chars:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def ingest_advice(pipeline, records: Iterable[Dict[str, Any]],
+                  batch_size: int = 512,
+                  max_chars: int = 1000,
+                  progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Chunk, embed and upsert advice records into ``pipeline`` in batches.
+
+    ``progress`` is called with the running totals after every batch.
+    """
+    stats = {"records": 0, "invalid": 0, "chunks": 0, "added": 0, "skipped_existing": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    # id -> (text, metadata); a dict also drops duplicates within a batch
+    batch: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+    def flush():
+        ids = list(batch)
+        added = pipeline.upsert_documents(
+            ids,
+            [batch[doc_id][0] for doc_id in ids],
+            [batch[doc_id][1] for doc_id in ids]
+        )
+        stats["added"] += added
+        stats["skipped_existing"] += len(ids) - added
+        stats["seconds"] = round(time.perf_counter() - start, 2)
+        batch.clear()
+        if progress:
+            progress(dict(stats))
+
+    for record in records:
+        stats["records"] += 1
+        parsed = parse_advice(record)
+        if parsed is None:
+            stats["invalid"] += 1
+            continue
+        text, metadata = parsed
+        chunks = chunk_text(text, max_chars)
+        for i, chunk in enumerate(chunks):
+            chunk_metadata = metadata if len(chunks) == 1 else {**metadata, "chunk": i, "chunks": len(chunks)}
+            batch[get_advice_id(chunk, chunk_metadata)] = (chunk, chunk_metadata)
+            stats["chunks"] += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    logger.info(f"Advice ingestion finished: {stats}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load advice into the knowledge base")
+    parser.add_argument("path", help="JSONL or CSV file of advice")
+    parser.add_argument("--format", choices=FORMATS, help="File format (default: from the extension)")
+    parser.add_argument("--batch-size", type=int, default=512, help="Chunks embedded per batch")
+    parser.add_argument("--max-chars", type=int, default=1000, help="Maximum characters per chunk")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        parser.error("Cannot tell the file format from its name; pass --format")
+
+    from services.model_registry import registry
+    pipeline = registry.get("rag_pipeline")
+
+    def report(stats: Dict[str, Any]):
+        rate = stats["chunks"] / stats["seconds"] if stats["seconds"] else 0.0
+        print(
+            f"{stats['records']} records, {stats['chunks']} chunks ({stats['added']} added, "
+            f"{stats['skipped_existing']} already stored, {stats['invalid']} invalid), {rate:.0f} chunks/s",
+            flush=True
+        )
+
+    with open(args.path, newline="", encoding="utf-8") as f:
+        ingest_advice(pipeline, read_advice_records(f, fmt), args.batch_size, args.max_chars, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,33 @@
 from typing import List, Dict, Any
+from functools import lru_cache
+import hashlib
+import json
+import re
+from .bm25 import tokenize
+
+# Words (matched as prefixes of query/profile tokens) that point at an advice category
+CATEGORY_KEYWORDS = {
+    "savings": ("save", "saving", "budget", "emergency"),
+    "investing": ("invest", "retire", "stock", "401k", "ira", "roth", "index", "portfolio"),
+    "debt": ("debt", "loan", "credit", "repay"),
+    "real_estate": ("house", "home", "mortgage", "heloc", "property", "rent"),
+    "taxes": ("tax",),
+    "protection": ("insur",),
+    "entrepreneurship": ("business", "startup", "self employ")
+}
+
+def get_advice_id(text: str, metadata: Dict[str, Any]) -> str:
+    """Get a stable id for a piece of advice derived from its content."""
+    payload = json.dumps({"text": text, "metadata": metadata}, sort_keys=True)
+    return f"kb_{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]}"
+
+def infer_categories(text: str) -> List[str]:
+    """Get the advice categories a piece of text (e.g. a profile) mentions."""
+    normalized = " ".join(tokenize(text))
+    return [
+        category for category, keywords in CATEGORY_KEYWORDS.items()
+        if any(re.search(rf"\b{keyword}", normalized) for keyword in keywords)
+    ]
 
 class FinancialKnowledgeBase:
     @staticmethod
@@ -63,12 +92,20 @@ class FinancialKnowledgeBase:
             }
         ]
     
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _advice_index() -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+        """Group the initial advice by category and by topic, built once."""
+        index: Dict[str, Dict[str, List[Dict[str, Any]]]] = {"category": {}, "topic": {}}
+        for advice in FinancialKnowledgeBase.get_initial_advice():
+            for field, groups in index.items():
+                groups.setdefault(advice["metadata"][field], []).append(advice)
+        return index
+    
     @staticmethod
     def get_advice_by_category(category: str) -> List[Dict[str, Any]]:
-        all_advice = FinancialKnowledgeBase.get_initial_advice()
-        return [advice for advice in all_advice if advice["metadata"]["category"] == category]
+        return list(FinancialKnowledgeBase._advice_index()["category"].get(category, []))
     
     @staticmethod
     def get_advice_by_topic(topic: str) -> List[Dict[str, Any]]:
-        all_advice = FinancialKnowledgeBase.get_initial_advice()
-        return [advice for advice in all_advice if advice["metadata"]["topic"] == topic] 
\ No newline at end of file
+        return list(FinancialKnowledgeBase._advice_index()["topic"].get(topic, [])) 
\ No newline at end of file
@@ -1,33 +1,69 @@
-from typing import List, Dict, Any
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-from langchain_community.llms import HuggingFaceHub
+from typing import List, Dict, Any, Optional
 from langchain.prompts import PromptTemplate
+from itertools import islice
+import asyncio
+import logging
 import os
-from .knowledge_base import FinancialKnowledgeBase
+import threading
+import time
+from services.llm_executor import LLMExecutor
+from services.model_registry import registry
+from services.response_cache import SemanticResponseCache
+from services.metrics import metrics
+from agents.output_parser import PLAN_SCHEMA, parse_output
+from .embeddings import EmbeddingService
+from .bm25 import BM25Index
+from .knowledge_base import FinancialKnowledgeBase, get_advice_id, infer_categories
+
+logger = logging.getLogger(__name__)
+
+# "hybrid" fuses BM25 and vector rankings; "vector" is plain nearest neighbours
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+# Candidates taken from each ranking before fusion (and reranking)
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+RETRIEVAL_PROFILE_FILTER = os.getenv("RETRIEVAL_PROFILE_FILTER", "true").lower() == "true"
+# Seconds between checks for documents other workers added to a shared Chroma
+# server; 0 disables (one worker owns the store)
+RAG_INDEX_REFRESH_SECONDS = float(os.getenv("RAG_INDEX_REFRESH_SECONDS", "0"))
+
+
+def _matches(metadata: Optional[Dict[str, Any]], where: Dict[str, Any]) -> bool:
+    """Evaluate the subset of Chroma ``where`` filters the pipeline builds."""
+    for field, condition in where.items():
+        value = (metadata or {}).get(field)
+        if isinstance(condition, dict):
+            if value not in condition.get("$in", [value]):
+                return False
+        elif value != condition:
+            return False
+    return True
 
 class RAGPipeline:
-    def __init__(self):
-        # Initialize the embedding model (using a smaller open-source model)
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        # Initialize ChromaDB
-        self.client = chromadb.Client(Settings(
-            persist_directory="./data/chroma",
-            anonymized_telemetry=False
-        ))
-        
-        # Initialize the LLM (using a smaller open-source model)
-        self.llm = HuggingFaceHub(
-            repo_id="google/flan-t5-small",
-            model_kwargs={"temperature": 0.7, "max_length": 512}
-        )
+    def __init__(self,
+                 embedding_service: Optional[EmbeddingService] = None,
+                 client: Optional[Any] = None,
+                 llm_executor: Optional[LLMExecutor] = None,
+                 response_cache: Optional[SemanticResponseCache] = None,
+                 reranker: Optional[Any] = None):
+        # Models and clients come from the process-wide registry unless injected,
+        # so every agent and endpoint shares one embedding model, store and LLM;
+        # the same embedding service embeds stored documents and queries
+        self.embedding_service = embedding_service or registry.get("embedding_service")
+        self.client = client or registry.get("chroma_client")
+        self.llm_executor = llm_executor or registry.get("llm_executor")
+        self.llm = self.llm_executor.llm
+        self.response_cache = response_cache or registry.get("response_cache")
+        # Optional cross-encoder that rescores the fused candidates
+        self.reranker = reranker or registry.get("reranker")
+        self.refresh_interval = RAG_INDEX_REFRESH_SECONDS
         
         # Create or get the collection
         self.collection = self.client.get_or_create_collection(
             name="financial_advice",
-            metadata={"hnsw:space": "cosine"}
+            metadata={"hnsw:space": "cosine"},
+            embedding_function=self.embedding_service
         )
         
         # Initialize the prompt template
@@ -51,77 +87,333 @@ class RAGPipeline:
         
         # Initialize with comprehensive financial advice
         self._initialize_knowledge_base()
+        self._build_indexes()
     
     def _initialize_knowledge_base(self):
-        """Initialize the knowledge base with comprehensive financial advice."""
+        """Sync the seed advice into the collection, embedding only what changed.
+        
+        Seed documents are stored under content-hash ids, so unchanged advice is
+        never re-embedded and a restart with an unchanged knowledge base does no
+        embedding work at all. Advice added at runtime is left untouched.
+        """
         initial_advice = FinancialKnowledgeBase.get_initial_advice()
+        wanted = {get_advice_id(item["text"], item["metadata"]): item for item in initial_advice}
+        
+        existing = self.collection.get(where={"source": "seed"}, include=["metadatas"])
+        existing_ids = set(existing["ids"])
+        
+        new_ids = [doc_id for doc_id in wanted if doc_id not in existing_ids]
+        removed_ids = [doc_id for doc_id in existing_ids if doc_id not in wanted]
+        
+        if not new_ids and not removed_ids:
+            logger.info(f"Knowledge base up to date ({len(existing_ids)} seed documents)")
+            return
+        
+        if removed_ids:
+            self.collection.delete(ids=removed_ids)
+        
+        if new_ids:
+            # Upsert: another worker may be syncing the same seed documents
+            self.collection.upsert(
+                documents=[wanted[doc_id]["text"] for doc_id in new_ids],
+                metadatas=[{**wanted[doc_id]["metadata"], "source": "seed"} for doc_id in new_ids],
+                ids=new_ids
+            )
+        
+        logger.info(
+            f"Knowledge base synced: {len(new_ids)} added, {len(removed_ids)} removed, "
+            f"{len(existing_ids) - len(removed_ids)} unchanged"
+        )
+    
+    def _build_indexes(self):
+        """Build the in-memory indexes over every stored document.
         
-        # Add initial advice to the collection
-        self.collection.add(
-            documents=[item["text"] for item in initial_advice],
-            metadatas=[item["metadata"] for item in initial_advice],
-            ids=[f"doc_{i}" for i in range(len(initial_advice))]
+        The category/topic index serves metadata lookups without touching the
+        vector index; the BM25 index is the lexical half of hybrid retrieval.
+        Embeddings are not loaded.
+        """
+        stored = self.collection.get(include=["documents", "metadatas"])
+        # value -> ids as an insertion-ordered set; bulk ingestion updates it
+        # from a worker thread, hence the lock
+        self._metadata_index: Dict[str, Dict[str, Dict[str, None]]] = {"category": {}, "topic": {}}
+        self._doc_metadata: Dict[str, Dict[str, Any]] = {}
+        self._index_lock = threading.Lock()
+        self.bm25 = BM25Index()
+        self._last_refresh = time.monotonic()
+        for doc_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            self._index_document(doc_id, text, metadata)
+    
+    def refresh_indexes(self) -> int:
+        """Index documents added or removed by other workers since the last refresh.
+        
+        Returns the number of documents that changed; cached plans are dropped
+        when any did.
+        """
+        stored_ids = self.collection.get(include=[])["ids"]
+        with self._index_lock:
+            added = [doc_id for doc_id in stored_ids if doc_id not in self._doc_metadata]
+            removed = set(self._doc_metadata).difference(stored_ids)
+        if added:
+            stored = self.collection.get(ids=added, include=["documents", "metadatas"])
+            for doc_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+                self._index_document(doc_id, text, metadata)
+        for doc_id in removed:
+            self._unindex_document(doc_id)
+        if added or removed:
+            logger.info(f"Indexes refreshed: {len(added)} added, {len(removed)} removed")
+            self.response_cache.invalidate()
+        return len(added) + len(removed)
+    
+    def _maybe_refresh(self):
+        if self.refresh_interval <= 0:
+            return
+        now = time.monotonic()
+        with self._index_lock:
+            if now - self._last_refresh < self.refresh_interval:
+                return
+            self._last_refresh = now
+        try:
+            self.refresh_indexes()
+        except Exception as e:
+            logger.warning(f"Index refresh failed: {str(e)}")
+    
+    def _index_document(self, doc_id: str, text: str, metadata: Optional[Dict[str, Any]]):
+        with self._index_lock:
+            self._doc_metadata[doc_id] = metadata or {}
+            for field, groups in self._metadata_index.items():
+                value = (metadata or {}).get(field)
+                if value is not None:
+                    groups.setdefault(value, {})[doc_id] = None
+        self.bm25.add(doc_id, text)
+    
+    def _unindex_document(self, doc_id: str):
+        with self._index_lock:
+            metadata = self._doc_metadata.pop(doc_id, {})
+            for field, groups in self._metadata_index.items():
+                ids = groups.get(metadata.get(field))
+                if ids is not None:
+                    ids.pop(doc_id, None)
+                    if not ids:
+                        del groups[metadata.get(field)]
+        self.bm25.remove(doc_id)
+    
+    def _get_advice_by(self, field: str, value: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        """Fetch one page of the documents whose ``field`` metadata equals ``value``."""
+        self._maybe_refresh()
+        with self._index_lock:
+            page_ids = list(islice(self._metadata_index[field].get(value, {}), offset, offset + limit))
+        if not page_ids:
+            return []
+        results = self.collection.get(ids=page_ids, include=["documents", "metadatas"])
+        found = {
+            doc_id: {"text": doc, "metadata": meta}
+            for doc_id, doc, meta in zip(results['ids'], results['documents'], results['metadatas'])
+        }
+        # Keep insertion order; ids deleted behind our back are skipped
+        return [found[doc_id] for doc_id in page_ids if doc_id in found]
+    
+    def upsert_documents(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]) -> int:
+        """Embed and store documents in one batch, skipping ids already stored.
+        
+        Ids are content hashes, so a stored id means the same text and metadata
+        are already embedded. Returns the number of documents added.
+        """
+        existing = set(self.collection.get(ids=ids, include=[])["ids"])
+        new = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+        if not new:
+            return 0
+        
+        new_ids = [ids[i] for i in new]
+        new_texts = [texts[i] for i in new]
+        new_metadatas = [metadatas[i] for i in new]
+        self.collection.upsert(
+            ids=new_ids,
+            documents=new_texts,
+            metadatas=new_metadatas,
+            embeddings=self.embedding_service.embed_documents(new_texts)
         )
+        for doc_id, text, metadata in zip(new_ids, new_texts, new_metadatas):
+            self._index_document(doc_id, text, metadata)
+        # Cached plans may have been built from a different set of documents
+        self.response_cache.invalidate()
+        return len(new_ids)
     
     def add_advice(self, text: str, topic: str, category: str) -> bool:
         """Add new financial advice to the knowledge base."""
         try:
-            # Get the current number of documents
-            count = self.collection.count()
-            
-            # Add the new advice
-            self.collection.add(
-                documents=[text],
-                metadatas=[{"topic": topic, "category": category}],
-                ids=[f"doc_{count}"]
-            )
+            # Content-hash id: re-adding the same advice is a no-op and
+            # concurrent adds can't collide
+            metadata = {"topic": topic, "category": category}
+            self.upsert_documents([get_advice_id(text, metadata)], [text], [metadata])
             return True
         except Exception as e:
             print(f"Error adding advice: {str(e)}")
             return False
     
-    def get_advice_by_category(self, category: str) -> List[Dict[str, Any]]:
-        """Retrieve advice by category."""
+    def get_advice_by_category(self, category: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Retrieve a page of advice by category."""
         try:
-            results = self.collection.query(
-                query_texts=[""],
-                where={"category": category},
-                n_results=10
-            )
-            return [
-                {"text": doc, "metadata": meta}
-                for doc, meta in zip(results['documents'][0], results['metadatas'][0])
-            ]
+            return self._get_advice_by("category", category, offset, limit)
         except Exception as e:
             print(f"Error retrieving advice by category: {str(e)}")
             return []
     
-    def get_advice_by_topic(self, topic: str) -> List[Dict[str, Any]]:
-        """Retrieve advice by topic."""
+    def get_advice_by_topic(self, topic: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Retrieve a page of advice by topic."""
         try:
-            results = self.collection.query(
-                query_texts=[""],
-                where={"topic": topic},
-                n_results=10
-            )
-            return [
-                {"text": doc, "metadata": meta}
-                for doc, meta in zip(results['documents'][0], results['metadatas'][0])
-            ]
+            return self._get_advice_by("topic", topic, offset, limit)
         except Exception as e:
             print(f"Error retrieving advice by topic: {str(e)}")
             return []
     
-    async def process_query(self, query: str) -> Dict[str, Any]:
-        try:
-            # Get relevant context from the knowledge base
+    def _query_documents(self, query: str, n_results: int,
+                         where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Run the vector query and return ranked documents with scores."""
+        query_embedding = self.embedding_service.embed_query(query)
+        with metrics.timer("vector_query_seconds", collection=self.collection.name):
             results = self.collection.query(
-                query_texts=[query],
-                n_results=3
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                where=where,
+                include=["documents", "metadatas", "distances"]
+            )
+        return [
+            {
+                "id": doc_id,
+                "text": doc,
+                "metadata": meta,
+                # Cosine distance -> similarity, higher is more relevant
+                "score": round(1 - distance, 4)
+            }
+            for doc_id, doc, meta, distance in zip(
+                results['ids'][0],
+                results['documents'][0],
+                results['metadatas'][0],
+                results['distances'][0]
             )
+        ]
+    
+    def _fetch_documents(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not ids:
+            return {}
+        results = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        return {
+            doc_id: {"id": doc_id, "text": doc, "metadata": meta}
+            for doc_id, doc, meta in zip(results['ids'], results['documents'], results['metadatas'])
+        }
+    
+    def _rerank(self, query: str, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with metrics.timer("rerank_seconds"):
+            scores = self.reranker.predict([(query, doc["text"]) for doc in documents])
+        for doc, score in zip(documents, scores):
+            doc["scores"]["rerank"] = round(float(score), 4)
+            doc["score"] = doc["scores"]["rerank"]
+        return sorted(documents, key=lambda doc: doc["score"], reverse=True)
+    
+    def _hybrid_search(self, query: str, n_results: int,
+                       where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Fuse BM25 and vector rankings with reciprocal-rank fusion.
+        
+        Each ranking contributes ``1 / (RRF_K + rank)`` per document, so exact
+        product names ("401(k)", "HELOC") found lexically surface even when
+        their embeddings are not the nearest. With a reranker configured, the
+        top fused candidates are rescored by the cross-encoder.
+        """
+        candidates = max(RETRIEVAL_CANDIDATES, n_results)
+        vector_docs = self._query_documents(query, candidates, where)
+        if RETRIEVAL_MODE != "hybrid" and self.reranker is None:
+            return vector_docs[:n_results]
+        
+        documents = {doc["id"]: {**doc, "scores": {"vector": doc["score"]}} for doc in vector_docs}
+        fused = {doc["id"]: 1 / (RRF_K + rank) for rank, doc in enumerate(vector_docs, 1)}
+        if RETRIEVAL_MODE == "hybrid":
+            allow = None
+            if where:
+                allow = lambda doc_id: _matches(self._doc_metadata.get(doc_id), where)
+            lexical = self.bm25.search(query, candidates, allow)
+            missing = self._fetch_documents([doc_id for doc_id, _ in lexical if doc_id not in documents])
+            for rank, (doc_id, bm25_score) in enumerate(lexical, 1):
+                if doc_id in missing:
+                    documents[doc_id] = {**missing[doc_id], "scores": {}}
+                if doc_id in documents:
+                    documents[doc_id]["scores"]["bm25"] = round(bm25_score, 4)
+                    fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (RRF_K + rank)
+        
+        ranked = sorted(fused, key=fused.get, reverse=True)
+        keep = max(n_results, RERANK_CANDIDATES) if self.reranker is not None else n_results
+        results = []
+        for doc_id in ranked[:keep]:
+            doc = documents[doc_id]
+            doc["score"] = round(fused[doc_id], 6)
+            results.append(doc)
+        if self.reranker is not None:
+            results = self._rerank(query, results)
+        return results[:n_results]
+    
+    def _search(self, query: str, n_results: int, profile: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Search, restricted to the categories the profile points at when it helps."""
+        self._maybe_refresh()
+        categories = []
+        if profile and RETRIEVAL_PROFILE_FILTER:
+            # The query's own categories stay in, so a direct question isn't filtered out
+            profile_text = " ".join(str(value) for value in profile.values())
+            categories = infer_categories(f"{query} {profile_text}")
+        if not categories:
+            return self._hybrid_search(query, n_results)
+        documents = self._hybrid_search(query, n_results, {"category": {"$in": categories}})
+        if len(documents) < n_results:
+            # Too little advice in those categories; top up from everything
+            seen = {doc["id"] for doc in documents}
+            documents += [doc for doc in self._hybrid_search(query, n_results) if doc["id"] not in seen]
+        return documents[:n_results]
+    
+    async def retrieve(self, query: str, n_results: int = 3,
+                       profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Retrieve the most relevant advice without generating a plan.
+        
+        ``profile`` (the parsed user profile) narrows the search to matching
+        advice categories.
+        """
+        try:
+            # Embedding the query is CPU-bound, keep it off the event loop
+            loop = asyncio.get_running_loop()
+            documents = await loop.run_in_executor(None, self._search, query, n_results, profile)
+            
+            return {
+                "success": True,
+                "message": "Relevant advice retrieved successfully",
+                "data": {
+                    "documents": documents,
+                    "topics_used": [doc["metadata"]["topic"] for doc in documents],
+                    "categories_used": [doc["metadata"]["category"] for doc in documents]
+                }
+            }
+            
+        except Exception as e:
+            return {
+                "success": False,
+                "message": "Failed to retrieve relevant advice",
+                "error": str(e)
+            }
+    
+    async def process_query(self, query: str, generate_plan: bool = True) -> Dict[str, Any]:
+        """Retrieve relevant advice and, by default, generate a plan from it.
+        
+        With ``generate_plan=False`` this is the same as ``retrieve``.
+        """
+        retrieval = await self.retrieve(query)
+        if not generate_plan or not retrieval["success"]:
+            return retrieval
+        
+        try:
+            documents = retrieval["data"]["documents"]
+            doc_ids = [doc["id"] for doc in documents]
+            cached = await self.response_cache.aget("rag_plan", query, None, doc_ids)
+            if cached is not None:
+                return cached
             
             # Combine relevant context
-            context = "\n".join(results['documents'][0])
+            context = "\n".join(doc["text"] for doc in documents)
             
             # Generate the prompt
             prompt = self.prompt_template.format(
@@ -130,34 +422,29 @@ class RAGPipeline:
             )
             
             # Generate response using the LLM
-            response = self.llm(prompt)
+            response = await self.llm_executor.agenerate(prompt)
             
             # Parse the response into structured data
-            sections = response.split("\n")
-            plan = {
-                "goal": sections[0] if len(sections) > 0 else "",
-                "steps": [s.strip() for s in sections[1].split(".") if s.strip()] if len(sections) > 1 else [],
-                "timeline": sections[2] if len(sections) > 2 else "",
-                "estimated_cost": sections[3] if len(sections) > 3 else "",
-                "risks": [s.strip() for s in sections[4].split(".") if s.strip()] if len(sections) > 4 else [],
-                "recommendations": [s.strip() for s in sections[5].split(".") if s.strip()] if len(sections) > 5 else []
-            }
+            with metrics.timer("parse_seconds", agent="rag_pipeline"):
+                plan = parse_output(response, PLAN_SCHEMA, defaults={"goal": query})
             
             # Add metadata about the advice used
             plan["metadata"] = {
-                "topics_used": [meta["topic"] for meta in results['metadatas'][0]],
-                "categories_used": [meta["category"] for meta in results['metadatas'][0]]
+                "topics_used": retrieval["data"]["topics_used"],
+                "categories_used": retrieval["data"]["categories_used"]
             }
             
-            return {
+            result = {
                 "success": True,
                 "message": "Financial plan generated successfully",
                 "data": plan
             }
+            await self.response_cache.aput("rag_plan", query, None, doc_ids, result)
+            return result
             
         except Exception as e:
             return {
                 "success": False,
                 "message": "Failed to generate financial plan",
                 "error": str(e)
-            } 
\ No newline at end of file
+            }
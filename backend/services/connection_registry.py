@@ -0,0 +1,262 @@
+from typing import Any, Dict, Optional
+from services.metrics import metrics
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS connections (
+    session_id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    connected_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_connections_worker ON connections (worker_id);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    worker_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_worker ON outbox (worker_id, id);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ConnectionRegistry:
+    """Tracks which WebSocket serves each session within this process."""
+
+    def __init__(self):
+        self._sockets: Dict[str, Any] = {}
+
+    def register(self, session_id: str, websocket: Any):
+        self._sockets[session_id] = websocket
+
+    def unregister(self, session_id: str, websocket: Optional[Any] = None):
+        """Forget a session's socket (only if it is still ``websocket``, when given)."""
+        if websocket is None or self._sockets.get(session_id) is websocket:
+            self._sockets.pop(session_id, None)
+
+    def is_local(self, session_id: str) -> bool:
+        return session_id in self._sockets
+
+    async def send(self, session_id: str, payload: Dict[str, Any]) -> bool:
+        """Send a payload to the session's socket; False if it is not connected."""
+        websocket = self._sockets.get(session_id)
+        if websocket is None:
+            return False
+        try:
+            await websocket.send_json(payload)
+        except Exception as e:
+            logger.warning(f"Dropping payload for session {session_id}: {str(e)}")
+            self.unregister(session_id, websocket)
+            return False
+        metrics.inc("ws_deliveries_total", route="local")
+        return True
+
+    async def close(self, session_id: str) -> bool:
+        """Close the session's socket; False if it is not connected."""
+        websocket = self._sockets.pop(session_id, None)
+        if websocket is None:
+            return False
+        try:
+            await websocket.close()
+        except Exception as e:
+            logger.warning(f"Error closing socket for session {session_id}: {str(e)}")
+        return True
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class SQLiteConnectionRegistry(ConnectionRegistry):
+    """Connection registry shared by every worker using one SQLite file.
+
+    Each worker records the sessions whose sockets it holds. Sending to a
+    session held elsewhere queues the payload in an outbox row addressed to
+    the owning worker, which polls its outbox and delivers (or closes) on
+    its local socket. Workers heartbeat while running; connections and
+    queued payloads of a worker that stops heartbeating are dropped.
+    """
+
+    def __init__(self, db_path: str, worker_id: Optional[str] = None,
+                 poll_interval: float = 0.1, stale_after: float = 30.0):
+        super().__init__()
+        self.db_path = db_path
+        self.worker_id = worker_id or default_worker_id()
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+        self._poll_task: Optional[asyncio.Task] = None
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def register(self, session_id: str, websocket: Any):
+        super().register(session_id, websocket)
+        self._execute(
+            "INSERT OR REPLACE INTO connections (session_id, worker_id, connected_at) VALUES (?, ?, ?)",
+            (session_id, self.worker_id, time.time())
+        )
+
+    def unregister(self, session_id: str, websocket: Optional[Any] = None):
+        if websocket is not None and self._sockets.get(session_id) is not websocket:
+            return
+        super().unregister(session_id)
+        self._execute(
+            "DELETE FROM connections WHERE session_id = ? AND worker_id = ?",
+            (session_id, self.worker_id)
+        )
+
+    def owner(self, session_id: str) -> Optional[str]:
+        """Id of the worker holding the session's socket, if any."""
+        rows = self._execute("SELECT worker_id FROM connections WHERE session_id = ?", (session_id,))
+        return rows[0][0] if rows else None
+
+    def _enqueue(self, session_id: str, kind: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+        owner = self.owner(session_id)
+        if owner is None or owner == self.worker_id:
+            return False
+        self._execute(
+            "INSERT INTO outbox (worker_id, session_id, kind, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (owner, session_id, kind, None if payload is None else json.dumps(payload, default=str), time.time())
+        )
+        metrics.inc("ws_deliveries_total", route="forwarded")
+        return True
+
+    async def send(self, session_id: str, payload: Dict[str, Any]) -> bool:
+        if self.is_local(session_id):
+            return await super().send(session_id, payload)
+        return self._enqueue(session_id, "message", payload)
+
+    async def close(self, session_id: str) -> bool:
+        if self.is_local(session_id):
+            closed = await super().close(session_id)
+            self._execute(
+                "DELETE FROM connections WHERE session_id = ? AND worker_id = ?",
+                (session_id, self.worker_id)
+            )
+            return closed
+        return self._enqueue(session_id, "close")
+
+    def _heartbeat(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO workers (worker_id, last_seen) VALUES (?, ?)",
+                    (self.worker_id, now)
+                )
+                stale = "(SELECT worker_id FROM workers WHERE last_seen < ?)"
+                cutoff = (now - self.stale_after,)
+                self._conn.execute(f"DELETE FROM connections WHERE worker_id IN {stale}", cutoff)
+                self._conn.execute(f"DELETE FROM outbox WHERE worker_id IN {stale}", cutoff)
+                self._conn.execute("DELETE FROM workers WHERE last_seen < ?", cutoff)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _take_outbox(self) -> list:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, session_id, kind, payload FROM outbox WHERE worker_id = ? ORDER BY id",
+                    (self.worker_id,)
+                ).fetchall()
+                if rows:
+                    self._conn.execute(
+                        "DELETE FROM outbox WHERE worker_id = ? AND id <= ?",
+                        (self.worker_id, rows[-1][0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    async def _deliver(self):
+        for _, session_id, kind, payload in self._take_outbox():
+            if kind == "close":
+                # A session that moved on since has a newer connection; leave it open
+                if self.is_local(session_id):
+                    await self.close(session_id)
+            else:
+                await super().send(session_id, json.loads(payload))
+
+    async def _poll(self):
+        heartbeat_every = max(int(self.stale_after / 3 / self.poll_interval), 1)
+        ticks = 0
+        while True:
+            try:
+                if ticks % heartbeat_every == 0:
+                    self._heartbeat()
+                ticks += 1
+                await self._deliver()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error polling connection outbox: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def start(self):
+        # A restarted worker can reuse its id (same host and pid)
+        self._execute("DELETE FROM connections WHERE worker_id = ?", (self.worker_id,))
+        self._execute("DELETE FROM outbox WHERE worker_id = ?", (self.worker_id,))
+        self._heartbeat()
+        self._poll_task = asyncio.create_task(self._poll())
+        logger.info(f"Connection registry started for worker {self.worker_id}")
+
+    async def stop(self):
+        if self._poll_task:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+        self._execute("DELETE FROM connections WHERE worker_id = ?", (self.worker_id,))
+        self._execute("DELETE FROM outbox WHERE worker_id = ?", (self.worker_id,))
+        self._execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+
+
+def create_connection_registry() -> ConnectionRegistry:
+    """Create the registry selected by CONNECTION_BACKEND (local or sqlite)."""
+    backend = os.getenv("CONNECTION_BACKEND", "local").lower()
+    if backend == "sqlite":
+        return SQLiteConnectionRegistry(
+            os.getenv("CONNECTION_DB_PATH", os.getenv("SESSION_DB_PATH", "./data/sessions.db")),
+            poll_interval=int(os.getenv("CONNECTION_POLL_MS", "100")) / 1000
+        )
+    if backend != "local":
+        raise ValueError(f"Unknown connection backend: {backend}")
+    return ConnectionRegistry()
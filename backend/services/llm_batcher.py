@@ -0,0 +1,78 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+BatchFunc = Callable[[List[str]], Awaitable[List[str]]]
+
+
+class MicroBatcher:
+    """Collect concurrent prompts for one model into batched calls.
+
+    Prompts submitted within ``max_wait_ms`` of the first pending prompt, up
+    to ``max_batch_size`` of them, are sent to ``run_batch`` together; each
+    caller gets back its own completion. A full batch is dispatched
+    immediately without waiting for the window to close.
+    """
+
+    def __init__(self, run_batch: BatchFunc, max_batch_size: int = 8,
+                 max_wait_ms: float = 10.0, name: str = "llm"):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: Set[asyncio.Task] = set()
+        self.stats = {"batches": 0, "prompts": 0, "largest_batch": 0}
+
+    async def submit(self, prompt: str) -> str:
+        """Queue a prompt and wait for its completion."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((prompt, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            # Callers that timed out or were cancelled no longer need a result
+            batch = [(prompt, future) for prompt, future in batch if not future.done()]
+            if batch:
+                task = asyncio.ensure_future(self._run(batch))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        self.stats["batches"] += 1
+        self.stats["prompts"] += len(batch)
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        try:
+            results = await self.run_batch([prompt for prompt, _ in batch])
+        except Exception as e:
+            logger.error(f"Batched call to {self.name} failed for {len(batch)} prompts: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "average_batch": round(self.stats["prompts"] / batches, 2) if batches else 0.0
+        }
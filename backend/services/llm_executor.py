@@ -0,0 +1,242 @@
+from typing import Any, AsyncIterator, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import os
+import threading
+import time
+from services.llm_batcher import MicroBatcher
+from services.metrics import metrics, count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+DEFAULT_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+THREAD_POOL_SIZE = int(os.getenv("LLM_THREAD_POOL_SIZE", "8"))
+# "auto" batches only backends that advertise real batched inference
+BATCHING = os.getenv("LLM_BATCHING", "auto").lower()
+BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("LLM_BATCH_MAX_WAIT_MS", "10"))
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_backend_limits: Dict[str, "BackendLimits"] = {}
+
+
+class LLMTimeoutError(Exception):
+    """Raised when an LLM call exceeds its backend timeout."""
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Get the bounded thread pool shared by all blocking LLM clients."""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=THREAD_POOL_SIZE,
+            thread_name_prefix="llm"
+        )
+    return _thread_pool
+
+
+class BackendLimits:
+    """Concurrency limit and timeout shared by every client of one backend."""
+
+    def __init__(self, backend: str, max_concurrency: int, timeout: float):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the server's running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+
+def get_backend_limits(backend: str,
+                       max_concurrency: Optional[int] = None,
+                       timeout: Optional[float] = None) -> BackendLimits:
+    """Get (or create) the limits registered for a backend."""
+    if backend not in _backend_limits:
+        _backend_limits[backend] = BackendLimits(
+            backend,
+            max_concurrency or DEFAULT_MAX_CONCURRENCY,
+            timeout or DEFAULT_TIMEOUT_SECONDS
+        )
+    return _backend_limits[backend]
+
+
+def has_native_async(llm: Any) -> bool:
+    """Check whether an LLM client implements a real async call path."""
+    acall = getattr(type(llm), "_acall", None)
+    if acall is None:
+        return False
+    try:
+        from langchain_core.language_models.llms import LLM
+    except ImportError:
+        return False
+    # The base class only wraps the sync call in the default executor
+    return acall is not LLM._acall
+
+
+class LLMExecutor:
+    """Run LLM generations without blocking the event loop.
+
+    Clients with a native async implementation are awaited directly; blocking
+    clients run on the shared bounded thread pool. Either way the call is
+    limited by the backend's semaphore and timeout. When batching is enabled
+    concurrent prompts are grouped by a MicroBatcher and each batch takes a
+    single semaphore slot.
+    """
+
+    def __init__(self, llm: Any, backend: str,
+                 max_concurrency: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 batching: Optional[str] = None):
+        self.llm = llm
+        self.backend = backend
+        self.limits = get_backend_limits(backend, max_concurrency, timeout)
+        self.native_async = has_native_async(llm)
+        self.batcher = None
+        if self._should_batch(batching if batching is not None else BATCHING):
+            self.batcher = MicroBatcher(
+                self._run_batch,
+                max_batch_size=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                name=backend
+            )
+
+    def _should_batch(self, batching: str) -> bool:
+        if batching == "auto":
+            return getattr(self.llm, "supports_batching", False)
+        return batching == "true" and hasattr(self.llm, "batch")
+
+    async def _run_batch(self, prompts: List[str]) -> List[str]:
+        async with self.limits.semaphore:
+            if self.native_async:
+                return await self.llm.abatch(prompts)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(get_thread_pool(), self.llm.batch, prompts)
+
+    def _call_sync(self, prompt: str) -> str:
+        if hasattr(self.llm, "invoke"):
+            return self.llm.invoke(prompt)
+        return self.llm(prompt)
+
+    async def _call(self, prompt: str) -> str:
+        if self.native_async:
+            return await self.llm.ainvoke(prompt)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_thread_pool(), self._call_sync, prompt)
+
+    def _record(self, prompt: str, completion: str, started: float):
+        metrics.observe("llm_generation_seconds", time.perf_counter() - started, backend=self.backend)
+        metrics.observe("llm_prompt_tokens", count_tokens(prompt), backend=self.backend)
+        metrics.observe("llm_completion_tokens", count_tokens(completion), backend=self.backend)
+
+    async def agenerate(self, prompt: str) -> str:
+        """Generate a completion for the prompt."""
+        started = time.perf_counter()
+        completion = await self._generate(prompt)
+        self._record(prompt, completion, started)
+        return completion
+
+    async def _generate(self, prompt: str) -> str:
+        if self.batcher:
+            try:
+                return await asyncio.wait_for(self.batcher.submit(prompt), timeout=self.limits.timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Batched LLM call to {self.backend} timed out after {self.limits.timeout}s")
+                raise LLMTimeoutError(
+                    f"LLM backend {self.backend} timed out after {self.limits.timeout}s"
+                )
+
+        async with self.limits.semaphore:
+            try:
+                return await asyncio.wait_for(self._call(prompt), timeout=self.limits.timeout)
+            except asyncio.TimeoutError:
+                # A blocking call keeps its worker thread until it returns,
+                # but the semaphore slot is released for other sessions
+                logger.error(f"LLM call to {self.backend} timed out after {self.limits.timeout}s")
+                raise LLMTimeoutError(
+                    f"LLM backend {self.backend} timed out after {self.limits.timeout}s"
+                )
+
+    def _stream_sync(self, prompt: str, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue,
+                     cancelled: threading.Event):
+        # Runs on the thread pool; hands each chunk back to the event loop
+        try:
+            if hasattr(self.llm, "stream"):
+                stream = self.llm.stream(prompt)
+                try:
+                    for chunk in stream:
+                        if cancelled.is_set():
+                            break
+                        loop.call_soon_threadsafe(queue.put_nowait, ("chunk", chunk))
+                finally:
+                    # Lets the backend stop generating once the consumer is gone
+                    close = getattr(stream, "close", None)
+                    if close:
+                        close()
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, ("chunk", self._call_sync(prompt)))
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        if self.native_async:
+            async for chunk in self.llm.astream(prompt):
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+        loop.run_in_executor(get_thread_pool(), self._stream_sync, prompt, loop, queue, cancelled)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            cancelled.set()
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Stream a completion chunk by chunk.
+
+        Backends without incremental output yield the whole completion as a
+        single chunk. The timeout applies to the stream as a whole. Closing
+        the stream early (``aclose``) stops generation on backends that
+        stream.
+        """
+        async with self.limits.semaphore:
+            started = time.perf_counter()
+            completion = []
+            deadline = time.monotonic() + self.limits.timeout
+            chunks = self._stream(prompt).__aiter__()
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(remaining, 0))
+                    except StopAsyncIteration:
+                        self._record(prompt, "".join(completion), started)
+                        return
+                    except asyncio.TimeoutError:
+                        logger.error(f"LLM stream from {self.backend} timed out after {self.limits.timeout}s")
+                        raise LLMTimeoutError(
+                            f"LLM backend {self.backend} timed out after {self.limits.timeout}s"
+                        )
+                    completion.append(chunk)
+                    yield chunk
+            except GeneratorExit:
+                # The consumer stopped early; count what was generated
+                self._record(prompt, "".join(completion), started)
+                raise
+            finally:
+                await chunks.aclose()
@@ -0,0 +1,118 @@
+from typing import Iterator, List, Optional
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class LocalSeq2SeqLLM:
+    """In-process CPU inference for a seq2seq model such as flan-t5-small.
+
+    Loads the tokenizer and model once, optionally applies int8 dynamic
+    quantization to the linear layers, and exposes the same ``invoke`` /
+    ``batch`` / ``stream`` surface the agents use on the hub client. Calls
+    are blocking; LLMExecutor runs them on its thread pool (torch releases
+    the GIL during inference). ``model_name`` may be a local directory, and
+    with ``HF_HUB_OFFLINE=1`` nothing is fetched from the network.
+    """
+
+    # Real batched generate, so LLMExecutor micro-batches concurrent prompts
+    supports_batching = True
+
+    def __init__(self, model_name: str = "google/flan-t5-small",
+                 quantize: bool = True,
+                 num_threads: Optional[int] = None,
+                 max_input_tokens: int = 512,
+                 max_new_tokens: int = 256,
+                 temperature: float = 0.7):
+        import torch
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.model_name = model_name
+        self.max_input_tokens = max_input_tokens
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self._torch = torch
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        logger.info(
+            f"Loaded local model {model_name} (quantized={quantize}, threads={torch.get_num_threads()})"
+        )
+
+    def _generate_kwargs(self):
+        kwargs = {"max_new_tokens": self.max_new_tokens}
+        if self.temperature > 0:
+            kwargs.update(do_sample=True, temperature=self.temperature)
+        return kwargs
+
+    def _encode(self, prompts: List[str]):
+        return self.tokenizer(
+            prompts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=self.max_input_tokens
+        )
+
+    def batch(self, prompts: List[str]) -> List[str]:
+        """Generate completions for several prompts in one forward pass."""
+        inputs = self._encode(prompts)
+        with self._torch.inference_mode():
+            outputs = self.model.generate(**inputs, **self._generate_kwargs())
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    def invoke(self, prompt: str) -> str:
+        return self.batch([prompt])[0]
+
+    __call__ = invoke
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the completion in chunks as tokens are generated.
+
+        Closing the generator early stops generation at the next token.
+        """
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = self._encode([prompt])
+        stop = threading.Event()
+
+        class StopWhenClosed(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs) -> bool:
+                return stop.is_set()
+
+        errors: List[Exception] = []
+
+        def generate():
+            try:
+                with self._torch.inference_mode():
+                    self.model.generate(
+                        **inputs,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([StopWhenClosed()]),
+                        **self._generate_kwargs()
+                    )
+            except Exception as e:
+                errors.append(e)
+                # Unblock the consumer below
+                streamer.end()
+
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        finally:
+            stop.set()
+        thread.join()
+        if errors:
+            raise errors[0]
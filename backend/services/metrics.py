@@ -0,0 +1,160 @@
+from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+import contextvars
+import logging
+import threading
+import time
+
+# Seconds; covers cache hits through slow remote generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+trace_id_var: contextvars.ContextVar = contextvars.ContextVar("trace_id", default="-")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def set_trace_id(trace_id: str):
+    """Tag everything logged from the current task with a trace id."""
+    trace_id_var.set(trace_id)
+
+
+class TraceIdFilter(logging.Filter):
+    """Add the current trace id to log records as ``trace_id``."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+def install_trace_logging():
+    """Include the trace id in every log line written by the root handlers."""
+    formatter = logging.Formatter("%(levelname)s:%(name)s:[%(trace_id)s] %(message)s")
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+        handler.setFormatter(formatter)
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # label key -> (bucket counts, sum, count)
+        self.series: Dict[LabelKey, List] = {}
+
+    def observe(self, value: float, key: LabelKey):
+        series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.series.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', str(bound)))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.series: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float, key: LabelKey):
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for key, value in self.series.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide histograms and counters rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, description, buckets))
+
+    def counter(self, name: str, description: str):
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, description))
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a value in a registered histogram."""
+        with self._lock:
+            self._metrics[name].observe(value, _label_key(labels))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Increment a registered counter."""
+        with self._lock:
+            self._metrics[name].inc(amount, _label_key(labels))
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Time the enclosed block (including awaits) into a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        with self._lock:
+            lines: List[str] = []
+            for metric in self._metrics.values():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count (whitespace-delimited words)."""
+    return len(text.split())
+
+
+metrics = MetricsRegistry()
+metrics.histogram("agent_process_seconds", "Time spent in BaseAgent.process by agent")
+metrics.histogram("stage_duration_seconds", "Duration of orchestrator stages")
+metrics.histogram("embedding_seconds", "Time spent encoding embeddings")
+metrics.histogram("vector_query_seconds", "Time spent in vector store queries")
+metrics.histogram("rerank_seconds", "Time spent reranking retrieved candidates")
+metrics.histogram("llm_generation_seconds", "Time spent generating completions")
+metrics.histogram("llm_prompt_tokens", "Approximate prompt tokens per generation", TOKEN_BUCKETS)
+metrics.histogram("llm_completion_tokens", "Approximate completion tokens per generation", TOKEN_BUCKETS)
+metrics.histogram("parse_seconds", "Time spent parsing LLM output")
+metrics.histogram("session_save_seconds", "Time spent persisting sessions")
+metrics.counter("cache_requests_total", "Cache lookups by cache and result")
+metrics.counter("session_save_conflicts_total", "Session saves retried after another worker saved first")
+metrics.counter("ws_deliveries_total", "WebSocket payloads by delivery route")
+metrics.counter("profile_updates_total", "Profile changes by source (rules or llm)")
+metrics.counter("ws_requests_total", "WebSocket requests by admission outcome")
+metrics.counter("ws_connections_closed_total", "WebSocket connections closed by reason")
+metrics.counter("structured_output_total", "Parsed LLM outputs by schema and whether they needed repair")
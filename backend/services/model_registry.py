@@ -0,0 +1,236 @@
+from typing import Any, Callable, Dict, List
+import asyncio
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LLM_REPO_ID = os.getenv("LLM_REPO_ID", "google/flan-t5-small")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# Cross-encoder for reranking retrieval candidates, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")
+
+
+def get_rss_mb() -> float:
+    """Get the current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    # Peak RSS on platforms without procfs (kilobytes on Linux, bytes on macOS)
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class ModelRegistry:
+    """Process-wide registry that loads each model and client exactly once.
+
+    Components are registered as factories and built on first ``get``; every
+    agent and endpoint then shares the same instance. Load state, load time
+    and the RSS growth observed while loading are tracked per component.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        """Register a factory; an already-loaded instance is kept."""
+        with self._registry_lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+            self._status.setdefault(name, {"state": "not_loaded"})
+
+    def set(self, name: str, instance: Any):
+        """Install a ready-made instance (e.g. a fake backend) under a name."""
+        with self._registry_lock:
+            self._locks.setdefault(name, threading.Lock())
+            self._instances[name] = instance
+            self._status[name] = {"state": "loaded", "load_time_ms": 0.0, "rss_delta_mb": 0.0}
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def get(self, name: str) -> Any:
+        """Get a component, loading it on first use."""
+        if name in self._instances:
+            return self._instances[name]
+        if name not in self._factories:
+            raise KeyError(f"No model or client registered as {name}")
+
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited
+            if name in self._instances:
+                return self._instances[name]
+
+            self._status[name] = {"state": "loading"}
+            rss_before = get_rss_mb()
+            start = time.perf_counter()
+            try:
+                instance = self._factories[name]()
+            except Exception as e:
+                self._status[name] = {"state": "failed", "error": str(e)}
+                logger.error(f"Failed to load {name}: {str(e)}")
+                raise
+
+            self._instances[name] = instance
+            self._status[name] = {
+                "state": "loaded",
+                "load_time_ms": round((time.perf_counter() - start) * 1000, 2),
+                "rss_delta_mb": round(get_rss_mb() - rss_before, 1)
+            }
+            logger.info(f"Loaded {name}: {self._status[name]}")
+            return instance
+
+    async def aget(self, name: str) -> Any:
+        """Get a component without blocking the event loop while it loads."""
+        if name in self._instances:
+            return self._instances[name]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get, name)
+
+    async def warm_up(self, names: List[str]) -> Dict[str, Any]:
+        """Load components in the background and log a startup-time breakdown."""
+        start = time.perf_counter()
+        for name in names:
+            try:
+                await self.aget(name)
+            except Exception:
+                # Already logged; the component is retried on first use
+                continue
+        breakdown = {
+            name: self._status[name].get("load_time_ms")
+            for name in self._status if self._status[name]["state"] == "loaded"
+        }
+        total_ms = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(f"Warm-up finished in {total_ms}ms, per component (ms): {breakdown}")
+        return breakdown
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get load state and memory usage for every registered component."""
+        return {
+            "rss_mb": get_rss_mb(),
+            "components": {name: dict(status) for name, status in self._status.items()}
+        }
+
+
+def _create_llm():
+    backend = os.getenv("LLM_BACKEND", "hub").lower()
+    if backend == "local":
+        from services.local_llm import LocalSeq2SeqLLM
+        num_threads = os.getenv("LOCAL_LLM_THREADS")
+        return LocalSeq2SeqLLM(
+            os.getenv("LOCAL_LLM_MODEL_PATH", LLM_REPO_ID),
+            quantize=os.getenv("LOCAL_LLM_QUANTIZE", "true").lower() == "true",
+            num_threads=int(num_threads) if num_threads else None,
+            max_new_tokens=int(os.getenv("LOCAL_LLM_MAX_NEW_TOKENS", "256"))
+        )
+    if backend != "hub":
+        raise ValueError(f"Unknown LLM backend: {backend}")
+
+    from langchain_community.llms import HuggingFaceHub
+    return HuggingFaceHub(
+        repo_id=LLM_REPO_ID,
+        model_kwargs={"temperature": 0.7, "max_length": 512}
+    )
+
+
+def _create_llm_executor():
+    from services.llm_executor import LLMExecutor
+    llm = registry.get("llm")
+    # Local and hub clients get separate concurrency limits
+    return LLMExecutor(llm, backend=f"{os.getenv('LLM_BACKEND', 'hub').lower()}:{LLM_REPO_ID}")
+
+
+def _create_tokenizer():
+    # Local models bring their own; otherwise load the hub model's tokenizer
+    tokenizer = getattr(registry.get("llm"), "tokenizer", None)
+    if tokenizer is not None:
+        return tokenizer
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(LLM_REPO_ID)
+    except Exception as e:
+        logger.warning(f"No tokenizer for {LLM_REPO_ID}, approximating prompt token counts: {str(e)}")
+        return None
+
+
+def _create_embedding_service():
+    from rag.embeddings import EmbeddingService
+    service = EmbeddingService(
+        EMBEDDING_MODEL_NAME,
+        quantize=os.getenv("EMBEDDING_QUANTIZE", "false").lower() == "true"
+    )
+    # Load the encoder now so its cost is attributed to this component
+    service.model
+    return service
+
+
+def _create_chroma_client():
+    import chromadb
+    from chromadb.config import Settings
+    settings = Settings(anonymized_telemetry=False)
+    host = os.getenv("CHROMA_HOST")
+    if host:
+        # A Chroma server, which several workers can share
+        return chromadb.HttpClient(host=host, port=int(os.getenv("CHROMA_PORT", "8000")), settings=settings)
+    if os.getenv("CONNECTION_BACKEND", "local").lower() == "sqlite":
+        logger.warning("Embedded Chroma is not safe across worker processes; set CHROMA_HOST to use a Chroma server")
+    return chromadb.PersistentClient(
+        path=os.getenv("CHROMA_PERSIST_DIR", "./data/chroma"),
+        settings=settings
+    )
+
+
+def _create_reranker():
+    if not RERANKER_MODEL:
+        return None
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANKER_MODEL, max_length=256)
+
+
+def _create_response_cache():
+    from services.response_cache import create_response_cache
+    return create_response_cache(registry.get("embedding_service"))
+
+
+def _create_rag_pipeline():
+    from rag.pipeline import RAGPipeline
+    return RAGPipeline()
+
+
+def _create_session_manager():
+    from services.session_manager import SessionManager
+    return SessionManager()
+
+
+def _create_connection_registry():
+    from services.connection_registry import create_connection_registry
+    return create_connection_registry()
+
+
+def _create_personal_assistant():
+    from agents.personal_assistant import PersonalAssistant
+    return PersonalAssistant()
+
+
+registry = ModelRegistry()
+registry.register("llm", _create_llm)
+registry.register("llm_executor", _create_llm_executor)
+registry.register("tokenizer", _create_tokenizer)
+registry.register("embedding_service", _create_embedding_service)
+registry.register("chroma_client", _create_chroma_client)
+registry.register("reranker", _create_reranker)
+registry.register("response_cache", _create_response_cache)
+registry.register("rag_pipeline", _create_rag_pipeline)
+registry.register("session_manager", _create_session_manager)
+registry.register("connection_registry", _create_connection_registry)
+registry.register("personal_assistant", _create_personal_assistant)
@@ -0,0 +1,202 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_goal(goal: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace."""
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s$%]", " ", goal.lower())).strip()
+
+
+def _coarse_value(value: Any) -> Any:
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        # Two significant digits: 61,000 and 64,000 share a bucket
+        return float(f"{value:.2g}")
+    if isinstance(value, str):
+        return normalize_goal(value)[:32]
+    if isinstance(value, (list, tuple)):
+        return sorted(str(_coarse_value(v)) for v in value)
+    if isinstance(value, dict):
+        return {k: _coarse_value(v) for k, v in value.items()}
+    return str(value)
+
+
+def profile_fingerprint(profile: Optional[Dict[str, Any]]) -> str:
+    """Get a coarse fingerprint of a profile; small wording changes don't alter it."""
+    if not profile:
+        return "none"
+    coarse = {key: _coarse_value(value) for key, value in profile.items()}
+    return hashlib.sha1(json.dumps(coarse, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class CacheEntry:
+    __slots__ = ("value", "expires_at", "vector", "bucket")
+
+    def __init__(self, value: Any, expires_at: float, vector: Optional[List[float]], bucket: Tuple):
+        self.value = value
+        self.expires_at = expires_at
+        self.vector = vector
+        self.bucket = bucket
+
+
+class SemanticResponseCache:
+    """Cache of generated responses keyed on goal, profile and retrieved documents.
+
+    Entries are grouped into buckets by (namespace, profile fingerprint,
+    retrieved document ids). A lookup first tries the exact normalized goal;
+    otherwise, if an embedding service is configured, it returns the entry in
+    the same bucket whose goal embedding is most similar, provided the
+    cosine similarity reaches ``similarity_threshold``. Entries expire after
+    ``ttl_seconds`` and the least recently used are evicted beyond
+    ``max_entries``. ``invalidate`` drops everything, e.g. when the knowledge
+    base changes. Safe to call from the event loop and worker threads alike.
+    """
+
+    def __init__(self, embedding_service: Optional[Any] = None,
+                 similarity_threshold: float = 0.92,
+                 ttl_seconds: float = 3600,
+                 max_entries: int = 1024):
+        self.embedding_service = embedding_service
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, CacheEntry]" = OrderedDict()
+        self._buckets: Dict[Tuple, set] = {}
+        # Bulk ingestion invalidates from a worker thread while lookups run on the loop
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _bucket(namespace: str, profile: Optional[Dict[str, Any]], doc_ids: Iterable[str]) -> Tuple:
+        return (namespace, profile_fingerprint(profile), tuple(sorted(doc_ids)))
+
+    def _embed(self, goal: str) -> Optional[List[float]]:
+        if self.embedding_service is None:
+            return None
+        try:
+            return self.embedding_service.embed_query(goal)
+        except Exception as e:
+            logger.warning(f"Response cache falling back to exact matching: {str(e)}")
+            return None
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._buckets.get(entry.bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[entry.bucket]
+
+    def _live(self, key: Tuple, now: float) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at < now:
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, namespace: str, goal: str, profile: Optional[Dict[str, Any]],
+            doc_ids: Iterable[str]) -> Optional[Any]:
+        """Look up a cached response, or return None on a miss."""
+        now = time.monotonic()
+        bucket = self._bucket(namespace, profile, doc_ids)
+        key = bucket + (normalize_goal(goal),)
+
+        with self._lock:
+            entry = self._live(key, now)
+            semantic = entry is None and bucket in self._buckets
+        # Embedding can be slow, so it runs outside the lock
+        vector = self._embed(goal) if semantic else None
+
+        with self._lock:
+            if vector is not None:
+                best_key, best_score = None, self.similarity_threshold
+                for candidate_key in list(self._buckets.get(bucket, ())):
+                    candidate = self._live(candidate_key, now)
+                    if candidate is None or candidate.vector is None:
+                        continue
+                    # Vectors are normalized, so the dot product is the cosine similarity
+                    score = sum(a * b for a, b in zip(vector, candidate.vector))
+                    if score >= best_score:
+                        best_key, best_score = candidate_key, score
+                if best_key is not None:
+                    key, entry = best_key, self._entries[best_key]
+                    self.stats["semantic_hits"] += 1
+            elif entry is not None and key not in self._entries:
+                # Invalidated since the first lookup
+                entry = None
+
+            if entry is None:
+                self.stats["misses"] += 1
+                metrics.inc("cache_requests_total", cache=namespace, result="miss")
+                return None
+
+            self.stats["hits"] += 1
+            metrics.inc("cache_requests_total", cache=namespace, result="hit")
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def put(self, namespace: str, goal: str, profile: Optional[Dict[str, Any]],
+            doc_ids: Iterable[str], value: Any):
+        """Cache a response."""
+        bucket = self._bucket(namespace, profile, doc_ids)
+        key = bucket + (normalize_goal(goal),)
+        vector = self._embed(goal)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = CacheEntry(value, time.monotonic() + self.ttl_seconds, vector, bucket)
+            self._buckets.setdefault(bucket, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats["evictions"] += 1
+
+    async def aget(self, namespace: str, goal: str, profile: Optional[Dict[str, Any]],
+                   doc_ids: Iterable[str]) -> Optional[Any]:
+        """``get`` off the event loop; a semantic lookup embeds the goal."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get, namespace, goal, profile, list(doc_ids))
+
+    async def aput(self, namespace: str, goal: str, profile: Optional[Dict[str, Any]],
+                   doc_ids: Iterable[str], value: Any):
+        """``put`` off the event loop; storing embeds the goal."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.put, namespace, goal, profile, list(doc_ids), value)
+
+    def invalidate(self):
+        """Drop every cached response."""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self.stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+            }
+
+
+def create_response_cache(embedding_service: Optional[Any] = None) -> SemanticResponseCache:
+    """Create the response cache configured from the environment."""
+    return SemanticResponseCache(
+        embedding_service,
+        similarity_threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92")),
+        ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+        max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+    )
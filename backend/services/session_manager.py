@@ -1,69 +1,206 @@
 from typing import Dict, Any, Optional
-from models.user_session import UserSession
-import json
+from collections import OrderedDict
+from models.user_session import UserSession, MAX_PROFILE_VERSIONS
+from models.conversation_history import ConversationHistory
+from services.session_store import SessionStore, SessionConflictError, JournalSessionStore
+import asyncio
+import logging
 import os
+import weakref
+from services.metrics import metrics
 from datetime import datetime, timedelta
 
+logger = logging.getLogger(__name__)
+
+# Reload-and-merge attempts when another worker saved the session first
+SAVE_CONFLICT_RETRIES = 3
+
+def create_session_store(storage_dir: str) -> SessionStore:
+    """Create the session store selected by SESSION_BACKEND (journal or sqlite)."""
+    backend = os.getenv("SESSION_BACKEND", "journal").lower()
+    if backend == "sqlite":
+        from services.sqlite_session_store import SQLiteSessionStore
+        store = SQLiteSessionStore(os.getenv("SESSION_DB_PATH", "./data/sessions.db"))
+        store.migrate_from_json(storage_dir)
+        return store
+    if backend != "journal":
+        raise ValueError(f"Unknown session backend: {backend}")
+    return JournalSessionStore(
+        storage_dir,
+        compact_every=int(os.getenv("SESSION_COMPACT_EVERY", "50"))
+    )
+
 class SessionManager:
-    def __init__(self, storage_dir: str = "./data/sessions"):
+    def __init__(self, storage_dir: str = "./data/sessions",
+                 store: Optional[SessionStore] = None,
+                 cache_size: Optional[int] = None):
         self.storage_dir = storage_dir
-        self.active_sessions: Dict[str, UserSession] = {}
+        # Bounded LRU of sessions in memory; the rest are loaded on demand
+        self.cache_size = cache_size or int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+        self.active_sessions: "OrderedDict[str, UserSession]" = OrderedDict()
         self._ensure_storage_dir()
-        self._load_sessions()
+        self.store = store or create_session_store(storage_dir)
+        # One lock per session in use; entries go away with their last holder
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
     
     def _ensure_storage_dir(self):
         """Ensure the storage directory exists."""
         if not os.path.exists(self.storage_dir):
             os.makedirs(self.storage_dir)
     
-    def _load_sessions(self):
-        """Load all sessions from storage."""
-        for filename in os.listdir(self.storage_dir):
-            if filename.endswith('.json'):
-                session_id = filename[:-5]  # Remove .json extension
-                self._load_session(session_id)
+    def _cache_session(self, session: UserSession):
+        """Add a session to the in-memory cache, evicting the least recently used."""
+        self.active_sessions[session.id] = session
+        self.active_sessions.move_to_end(session.id)
+        while len(self.active_sessions) > self.cache_size:
+            evicted_id, _ = self.active_sessions.popitem(last=False)
+            self.store.release(evicted_id)
     
-    def _load_session(self, session_id: str):
+    def _load_session(self, session_id: str) -> Optional[UserSession]:
         """Load a specific session from storage."""
-        filepath = os.path.join(self.storage_dir, f"{session_id}.json")
-        if os.path.exists(filepath):
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-                session = UserSession(**data)
-                self.active_sessions[session_id] = session
+        session = self.store.load(session_id)
+        if session:
+            self._cache_session(session)
+        return session
     
     def _save_session(self, session: UserSession):
         """Save a session to storage."""
-        filepath = os.path.join(self.storage_dir, f"{session.id}.json")
-        with open(filepath, 'w') as f:
-            json.dump(session.dict(), f, default=str)
+        with metrics.timer("session_save_seconds", store=type(self.store).__name__):
+            self.store.save(session)
     
     def create_session(self) -> UserSession:
         """Create a new user session."""
         session = UserSession()
-        self.active_sessions[session.id] = session
+        self._cache_session(session)
         self._save_session(session)
         return session
     
     def get_session(self, session_id: str) -> Optional[UserSession]:
-        """Get a session by ID."""
-        return self.active_sessions.get(session_id)
+        """Get a session by ID, loading it from storage if it is not cached.
+        
+        With a shared store the cached copy is only used while its version
+        matches storage; otherwise another worker has moved it on.
+        """
+        if not session_id:
+            return None
+        session = self.active_sessions.get(session_id)
+        if session and self.store.shared:
+            stored_version = self.store.get_version(session_id)
+            if stored_version != session.version:
+                self.active_sessions.pop(session_id)
+                self.store.release(session_id)
+                session = None
+                if stored_version is None:
+                    return None
+        if session:
+            self.active_sessions.move_to_end(session_id)
+            return session
+        return self._load_session(session_id)
     
     def update_session(self, session: UserSession):
-        """Update a session and save it."""
-        self.active_sessions[session.id] = session
-        self._save_session(session)
+        """Update a session and save it.
+        
+        If another worker saved the session first, its messages are merged
+        in and the save is retried.
+        """
+        self._cache_session(session)
+        for attempt in range(SAVE_CONFLICT_RETRIES + 1):
+            try:
+                self._save_session(session)
+                return
+            except SessionConflictError:
+                if attempt == SAVE_CONFLICT_RETRIES:
+                    raise
+                metrics.inc("session_save_conflicts_total")
+                logger.info(f"Session {session.id} changed elsewhere; merging before saving")
+                self._merge_stored(session)
     
-    def cleanup_inactive_sessions(self, days: int = 30):
+    def session_lock(self, session_id: str) -> asyncio.Lock:
+        """Lock held for a whole turn, so turns of one session don't interleave."""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+    
+    def discard_changes(self, session: UserSession):
+        """Drop a cached session with unsaved changes; the next read reloads the saved copy."""
+        if self.active_sessions.get(session.id) is session:
+            del self.active_sessions[session.id]
+            self.store.release(session.id)
+    
+    def _merge_stored(self, session: UserSession):
+        """Rebase a session onto its stored copy, keeping the messages only it has."""
+        self.store.release(session.id)
+        stored = self.store.load(session.id)
+        if stored is None:
+            # Deleted elsewhere; saving recreates it
+            session.version = 0
+            return
+        stored_ids = {message.id for message in stored.conversation_history}
+        session.conversation_history = ConversationHistory(list(stored.conversation_history) + [
+            message for message in session.conversation_history if message.id not in stored_ids
+        ])
+        self._merge_profile(session, stored)
+        session.preferences = session.preferences or stored.preferences
+        session.last_active = max(session.last_active, stored.last_active)
+        session.version = stored.version
+    
+    def _merge_profile(self, session: UserSession, stored: UserSession):
+        """Replay the profile versions only this copy has on top of the stored ones."""
+        if not session.profile_history and not stored.profile_history:
+            session.user_profile = session.user_profile or stored.user_profile
+            return
+        committed = {(v.version, v.timestamp) for v in stored.profile_history}
+        oldest = stored.profile_history[0].version if stored.profile_history else 0
+        pending = [
+            v for v in session.profile_history
+            if (v.version, v.timestamp) not in committed and v.version >= oldest
+        ]
+        profile = dict(stored.user_profile or {})
+        history = list(stored.profile_history)
+        for version in pending:
+            changes = {key: value for key, value in version.changes.items() if profile.get(key) != value}
+            if not changes:
+                continue
+            for key, value in changes.items():
+                if value is None:
+                    profile.pop(key, None)
+                else:
+                    profile[key] = value
+            history.append(version.copy(update={
+                "version": (history[-1].version if history else 0) + 1,
+                "changes": changes,
+                "confidence": {key: value for key, value in version.confidence.items() if key in changes}
+            }))
+        session.user_profile = profile or stored.user_profile
+        session.profile_history = history[-MAX_PROFILE_VERSIONS:]
+    
+    def delete_session(self, session_id: str):
+        """Delete a session from memory and storage."""
+        self.active_sessions.pop(session_id, None)
+        self.store.delete(session_id)
+    
+    def cleanup_inactive_sessions(self, days: int = 30) -> int:
         """Remove sessions inactive for more than specified days."""
         cutoff = datetime.now() - timedelta(days=days)
         for session_id, session in list(self.active_sessions.items()):
             if session.last_active < cutoff:
                 del self.active_sessions[session_id]
-                filepath = os.path.join(self.storage_dir, f"{session_id}.json")
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+        return self.store.delete_inactive(cutoff)
     
     def get_active_sessions(self) -> Dict[str, UserSession]:
-        """Get all active sessions."""
-        return self.active_sessions 
\ No newline at end of file
+        """Get the sessions currently held in memory."""
+        return self.active_sessions
+    
+    def list_sessions(self, offset: int = 0, limit: int = 50,
+                      active_since: Optional[datetime] = None) -> Dict[str, Any]:
+        """Get one page of session summaries, most recently active first."""
+        if active_since is not None and active_since.tzinfo is not None:
+            # Sessions record naive local times
+            active_since = active_since.astimezone().replace(tzinfo=None)
+        total, sessions = self.store.list_sessions(offset, limit, active_since)
+        return {"total": total, "offset": offset, "limit": limit, "sessions": sessions}
+    
+    def get_session_index(self) -> Dict[str, Dict[str, Any]]:
+        """Get id, last_active and size for every stored session."""
+        return self.store.get_index()
@@ -0,0 +1,332 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from models.user_session import UserSession, MAX_PROFILE_VERSIONS
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_json(filepath: str, data: Any):
+    """Write JSON to a temporary file and rename it over the target."""
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+
+def _fingerprint(data: Any) -> str:
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class SessionConflictError(Exception):
+    """Raised when a session was saved elsewhere since this copy was loaded."""
+    pass
+
+
+class SessionStore(ABC):
+    """Storage backend used by SessionManager."""
+
+    # Whether other processes may write to the same storage
+    shared = False
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[UserSession]:
+        """Load a session, or return None if it does not exist."""
+        pass
+
+    @abstractmethod
+    def save(self, session: UserSession):
+        """Persist a session and bump its version.
+
+        Raises SessionConflictError if the stored version is not the one the
+        session was loaded at.
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Remove a session from storage."""
+        pass
+
+    @abstractmethod
+    def list_ids(self) -> List[str]:
+        """List the ids of all stored sessions."""
+        pass
+
+    @abstractmethod
+    def get_index(self) -> Dict[str, Dict[str, Any]]:
+        """Get id, last_active and size for every stored session."""
+        pass
+
+    def get_version(self, session_id: str) -> Optional[int]:
+        """Get the stored version of a session, or None if it does not exist."""
+        session = self.load(session_id)
+        return session.version if session else None
+
+    def release(self, session_id: str):
+        """Drop any per-session bookkeeping once a session leaves memory."""
+        pass
+
+    def list_sessions(self, offset: int = 0, limit: int = 50,
+                      active_since: Optional[datetime] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """Get the total count and one page of index entries, most recent first."""
+        entries = list(self.get_index().values())
+        if active_since:
+            entries = [e for e in entries if datetime.fromisoformat(e["last_active"]) >= active_since]
+        entries.sort(key=lambda e: datetime.fromisoformat(e["last_active"]), reverse=True)
+        return len(entries), entries[offset:offset + limit]
+
+    def delete_inactive(self, cutoff: datetime) -> int:
+        """Delete every session last active before the cutoff; returns the count."""
+        expired = [
+            session_id for session_id, entry in self.get_index().items()
+            if datetime.fromisoformat(entry["last_active"]) < cutoff
+        ]
+        for session_id in expired:
+            self.delete(session_id)
+        return len(expired)
+
+
+class JournalSessionStore(SessionStore):
+    """Per-session append-only journal with periodic snapshot compaction.
+
+    Each session is stored as ``<id>.json`` (an atomically written snapshot)
+    plus ``<id>.log`` (one JSON event per line). Saving appends only what
+    changed since the last save - new messages, profile or preference
+    changes - so a turn costs constant I/O regardless of history length.
+    Once the log holds ``compact_every`` events it is folded into a new
+    snapshot. Every event carries a sequence number and the snapshot records
+    the last one it contains, so a crash between writing the snapshot and
+    truncating the log never replays an event twice.
+
+    A small append-only index (``_index.jsonl``) records id, last_active and
+    on-disk size per session, so sessions can be listed and expired without
+    opening their files.
+    """
+
+    INDEX_FILENAME = "_index.jsonl"
+
+    def __init__(self, storage_dir: str, compact_every: int = 50, fsync: bool = False):
+        self.storage_dir = storage_dir
+        self.compact_every = compact_every
+        self.fsync = fsync
+        # What has been persisted per session: message count, fingerprints, seq
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._index: Dict[str, Dict[str, Any]] = {}
+        os.makedirs(self.storage_dir, exist_ok=True)
+        self._load_index()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.storage_dir, self.INDEX_FILENAME)
+
+    def _load_index(self):
+        index_path = self._index_path()
+        if not os.path.exists(index_path):
+            self._rebuild_index()
+            return
+
+        lines = 0
+        torn = False
+        with open(index_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    torn = True
+                    break
+                lines += 1
+                if entry.get("deleted"):
+                    self._index.pop(entry["id"], None)
+                else:
+                    self._index[entry["id"]] = entry
+
+        # Drop superseded entries (and any torn line) once they dominate the file
+        if torn or lines > 2 * len(self._index) + 100:
+            self._write_index()
+
+    def _rebuild_index(self):
+        """Build the index from the session files (one-off for older data dirs)."""
+        for filename in os.listdir(self.storage_dir):
+            if filename.endswith('.json'):
+                session = self.load(filename[:-5])
+                if session:
+                    self._index[session.id] = self._index_entry(session)
+        self._state.clear()
+        self._write_index()
+
+    def _write_index(self):
+        tmp_path = f"{self._index_path()}.tmp"
+        with open(tmp_path, 'w') as f:
+            for entry in self._index.values():
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._index_path())
+
+    def _append_index(self, entry: Dict[str, Any]):
+        with open(self._index_path(), 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _index_entry(self, session: UserSession) -> Dict[str, Any]:
+        size = 0
+        for path in (self._snapshot_path(session.id), self._log_path(session.id)):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return {"id": session.id, "last_active": str(session.last_active), "size": size}
+
+    def _update_index(self, session: UserSession):
+        entry = self._index_entry(session)
+        self._index[session.id] = entry
+        self._append_index(entry)
+
+    def _snapshot_path(self, session_id: str) -> str:
+        return os.path.join(self.storage_dir, f"{session_id}.json")
+
+    def _log_path(self, session_id: str) -> str:
+        return os.path.join(self.storage_dir, f"{session_id}.log")
+
+    def _remember(self, session: UserSession, seq: int, pending: int):
+        self._state[session.id] = {
+            "messages": len(session.conversation_history),
+            "profile": _fingerprint(session.user_profile),
+            "preferences": _fingerprint(session.preferences),
+            "profile_version": session.profile_version,
+            "last_active": str(session.last_active),
+            "seq": seq,
+            "pending": pending,
+            "version": session.version
+        }
+
+    def load(self, session_id: str) -> Optional[UserSession]:
+        snapshot_path = self._snapshot_path(session_id)
+        if not os.path.exists(snapshot_path):
+            return None
+
+        with open(snapshot_path, 'r') as f:
+            data = json.load(f)
+        seq = data.pop("journal_seq", 0)
+        pending = 0
+
+        log_path = self._log_path(session_id)
+        if os.path.exists(log_path):
+            valid_bytes = 0
+            with open(log_path, 'rb') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn final write from a crash; drop it so later appends
+                        # start on a clean line
+                        logger.warning(f"Dropping truncated journal entry for session {session_id}")
+                        with open(log_path, 'r+b') as log:
+                            log.truncate(valid_bytes)
+                        break
+                    valid_bytes += len(line)
+                    if event["seq"] <= seq:
+                        continue
+                    self._apply(data, event)
+                    seq = event["seq"]
+                    pending += 1
+
+        session = UserSession(**data)
+        self._remember(session, seq, pending)
+        return session
+
+    @staticmethod
+    def _apply(data: Dict[str, Any], event: Dict[str, Any]):
+        if event["type"] == "message":
+            data.setdefault("conversation_history", []).append(event["data"])
+        elif event["type"] == "profile":
+            data["user_profile"] = event["data"]
+        elif event["type"] == "preferences":
+            data["preferences"] = event["data"]
+        elif event["type"] == "profile_version":
+            history = data.setdefault("profile_history", [])
+            history.append(event["data"])
+            del history[:-MAX_PROFILE_VERSIONS]
+        data["last_active"] = event["last_active"]
+        data["version"] = event.get("version", data.get("version", 0))
+
+    def _compact(self, session: UserSession, seq: int):
+        data = session.dict()
+        data["journal_seq"] = seq
+        atomic_write_json(self._snapshot_path(session.id), data)
+        log_path = self._log_path(session.id)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        self._remember(session, seq, 0)
+
+    def save(self, session: UserSession):
+        state = self._state.get(session.id)
+        if state is not None and session.version != state["version"]:
+            raise SessionConflictError(
+                f"Session {session.id} is at version {state['version']}, not {session.version}"
+            )
+        if (state is None or len(session.conversation_history) < state["messages"]
+                or not os.path.exists(self._snapshot_path(session.id))):
+            # Unknown on-disk state or rewritten history: start from a fresh snapshot
+            session.version += 1
+            self._compact(session, state["seq"] if state else 0)
+            self._update_index(session)
+            return
+
+        last_active = str(session.last_active)
+        events = []
+        for message in session.conversation_history[state["messages"]:]:
+            events.append({"type": "message", "data": message.dict()})
+        if _fingerprint(session.user_profile) != state["profile"]:
+            events.append({"type": "profile", "data": session.user_profile})
+        for version in session.profile_history:
+            if version.version > state.get("profile_version", 0):
+                events.append({"type": "profile_version", "data": version.dict()})
+        if _fingerprint(session.preferences) != state["preferences"]:
+            events.append({"type": "preferences", "data": session.preferences})
+        if not events and last_active != state["last_active"]:
+            events.append({"type": "touch"})
+        if not events:
+            return
+
+        session.version += 1
+        seq = state["seq"]
+        lines = []
+        for event in events:
+            seq += 1
+            event["seq"] = seq
+            event["last_active"] = last_active
+            event["version"] = session.version
+            lines.append(json.dumps(event, default=str))
+
+        pending = state["pending"] + len(events)
+        if pending >= self.compact_every:
+            self._compact(session, seq)
+        else:
+            with open(self._log_path(session.id), 'a') as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self._remember(session, seq, pending)
+        self._update_index(session)
+
+    def delete(self, session_id: str):
+        for path in (self._snapshot_path(session_id), self._log_path(session_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        self._state.pop(session_id, None)
+        if self._index.pop(session_id, None) is not None:
+            self._append_index({"id": session_id, "deleted": True})
+
+    def release(self, session_id: str):
+        self._state.pop(session_id, None)
+
+    def list_ids(self) -> List[str]:
+        return list(self._index)
+
+    def get_index(self) -> Dict[str, Dict[str, Any]]:
+        return self._index
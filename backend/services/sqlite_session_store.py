@@ -0,0 +1,279 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from models.user_session import UserSession
+from services.session_store import SessionStore, SessionConflictError, JournalSessionStore
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    last_active TEXT NOT NULL,
+    user_profile TEXT,
+    preferences TEXT,
+    profile_history TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions (last_active);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    metadata TEXT,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+ADDED_COLUMNS = {
+    "version": "INTEGER NOT NULL DEFAULT 0",
+    "profile_history": "TEXT"
+}
+
+SUMMARY_COLUMNS = "id, created_at, last_active, message_count, size"
+
+
+def _to_iso(value: Any) -> str:
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def _dumps(value: Any) -> Optional[str]:
+    return None if value is None else json.dumps(value, default=str)
+
+
+def _loads(value: Optional[str]) -> Any:
+    return None if value is None else json.loads(value)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store on embedded SQLite in WAL mode.
+
+    Session rows are indexed on ``last_active`` so paginated listing and
+    inactivity cleanup are single indexed queries. Messages live in their
+    own table keyed by (session_id, seq) and only new ones are inserted on
+    save, so a turn costs constant I/O.
+
+    Several processes can share one database file: every save checks and
+    bumps the row's ``version`` inside its write transaction, so a save
+    from a stale copy raises SessionConflictError instead of overwriting
+    another worker's turn.
+    """
+
+    shared = True
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        # Databases created before these columns existed
+        for column, definition in ADDED_COLUMNS.items():
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} {definition}")
+
+    def _summary(self, row: Tuple) -> Dict[str, Any]:
+        return {
+            "id": row[0],
+            "created_at": row[1],
+            "last_active": row[2],
+            "message_count": row[3],
+            "size": row[4]
+        }
+
+    def load(self, session_id: str) -> Optional[UserSession]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, created_at, last_active, user_profile, preferences, version, profile_history "
+                "FROM sessions WHERE id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            messages = self._conn.execute(
+                "SELECT id, timestamp, role, content, metadata FROM messages "
+                "WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+
+        return UserSession(
+            id=row[0],
+            created_at=row[1],
+            last_active=row[2],
+            user_profile=_loads(row[3]),
+            preferences=_loads(row[4]),
+            version=row[5],
+            profile_history=_loads(row[6]) or [],
+            conversation_history=[
+                {"id": m[0], "timestamp": m[1], "role": m[2], "content": m[3], "metadata": _loads(m[4])}
+                for m in messages
+            ]
+        )
+
+    def save(self, session: UserSession):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT message_count, size, version FROM sessions WHERE id = ?", (session.id,)
+                ).fetchone()
+                stored_count, size, stored_version = row if row else (0, 0, 0)
+                if row and stored_version != session.version:
+                    raise SessionConflictError(
+                        f"Session {session.id} is at version {stored_version}, not {session.version}"
+                    )
+                history = session.conversation_history
+                if len(history) < stored_count:
+                    # History was rewritten rather than appended to
+                    self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session.id,))
+                    stored_count, size = 0, 0
+
+                new_rows = []
+                for seq in range(stored_count, len(history)):
+                    message = history[seq]
+                    metadata = _dumps(message.metadata)
+                    size += len(message.content) + len(metadata or "")
+                    new_rows.append((
+                        session.id, seq, message.id, _to_iso(message.timestamp),
+                        message.role, message.content, metadata
+                    ))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO messages (session_id, seq, id, timestamp, role, content, metadata) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    new_rows
+                )
+                self._conn.execute(
+                    "INSERT INTO sessions (id, created_at, last_active, user_profile, preferences, "
+                    "profile_history, message_count, size, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET last_active = excluded.last_active, "
+                    "user_profile = excluded.user_profile, preferences = excluded.preferences, "
+                    "profile_history = excluded.profile_history, "
+                    "message_count = excluded.message_count, size = excluded.size, version = excluded.version",
+                    (
+                        session.id, _to_iso(session.created_at), _to_iso(session.last_active),
+                        _dumps(session.user_profile), _dumps(session.preferences),
+                        _dumps([version.dict() for version in session.profile_history]), len(history), size,
+                        stored_version + 1
+                    )
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        session.version = stored_version + 1
+
+    def get_version(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def list_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM sessions")]
+
+    def get_index(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {SUMMARY_COLUMNS} FROM sessions").fetchall()
+        return {row[0]: self._summary(row) for row in rows}
+
+    def list_sessions(self, offset: int = 0, limit: int = 50,
+                      active_since: Optional[datetime] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        where, params = "", []
+        if active_since:
+            where, params = "WHERE last_active >= ?", [_to_iso(active_since)]
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM sessions {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM sessions {where} "
+                "ORDER BY last_active DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return total, [self._summary(row) for row in rows]
+
+    def delete_inactive(self, cutoff: datetime) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM messages WHERE session_id IN "
+                    "(SELECT id FROM sessions WHERE last_active < ?)",
+                    (_to_iso(cutoff),)
+                )
+                deleted = self._conn.execute(
+                    "DELETE FROM sessions WHERE last_active < ?", (_to_iso(cutoff),)
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deleted
+
+    def migrate_from_json(self, storage_dir: str) -> int:
+        """Import sessions from a JSON/journal session directory (runs once)."""
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT value FROM store_meta WHERE key = 'json_migrated'"
+            ).fetchone()
+        if done or not os.path.isdir(storage_dir):
+            return 0
+
+        source = JournalSessionStore(storage_dir)
+        existing = set(self.list_ids())
+        migrated = 0
+        for session_id in source.list_ids():
+            if session_id in existing:
+                continue
+            session = source.load(session_id)
+            if session:
+                self.save(session)
+                migrated += 1
+            source.release(session_id)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.now().isoformat(),)
+            )
+        logger.info(f"Migrated {migrated} sessions from {storage_dir} into {self.db_path}")
+        return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate JSON session files into SQLite")
+    parser.add_argument("storage_dir", help="Directory holding the JSON session files")
+    parser.add_argument("db_path", help="SQLite database to migrate into")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    SQLiteSessionStore(args.db_path).migrate_from_json(args.storage_dir)
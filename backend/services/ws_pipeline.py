@@ -0,0 +1,263 @@
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from collections import deque
+from fastapi import WebSocket, WebSocketDisconnect
+from services.metrics import metrics
+import asyncio
+import itertools
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Requests a connection runs at once, and how many more it may queue
+WS_CONNECTION_CONCURRENCY = int(os.getenv("WS_CONNECTION_CONCURRENCY", "2"))
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "4"))
+# Requests queued or running per session and across the process
+WS_MAX_INFLIGHT_PER_SESSION = int(os.getenv("WS_MAX_INFLIGHT_PER_SESSION", "2"))
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "64"))
+# A newer message for a session cancels its queued and running requests
+WS_CANCEL_SUPERSEDED = os.getenv("WS_CANCEL_SUPERSEDED", "true").lower() == "true"
+# Seconds; 0 disables. Silent clients are pinged after the heartbeat interval
+# and closed if they send nothing within the heartbeat timeout
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "600"))
+WS_HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("WS_HEARTBEAT_INTERVAL_SECONDS", "30"))
+WS_HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("WS_HEARTBEAT_TIMEOUT_SECONDS", "10"))
+
+BUSY_RETRY_AFTER_SECONDS = 1
+
+
+class AdmissionController:
+    """Caps requests in flight (queued or running) per session and overall."""
+
+    def __init__(self, max_inflight: int = WS_MAX_INFLIGHT,
+                 max_per_session: int = WS_MAX_INFLIGHT_PER_SESSION):
+        self.max_inflight = max_inflight
+        self.max_per_session = max_per_session
+        self.inflight = 0
+        self._per_session: Dict[str, int] = {}
+
+    def try_acquire(self, key: str) -> bool:
+        if self.inflight >= self.max_inflight or self._per_session.get(key, 0) >= self.max_per_session:
+            return False
+        self.inflight += 1
+        self._per_session[key] = self._per_session.get(key, 0) + 1
+        return True
+
+    def release(self, key: str):
+        self.inflight -= 1
+        remaining = self._per_session.get(key, 1) - 1
+        if remaining:
+            self._per_session[key] = remaining
+        else:
+            self._per_session.pop(key, None)
+
+
+class _Request:
+    def __init__(self, message: Dict[str, Any], key: str):
+        self.message = message
+        self.key = key
+        self.request_id = message.get("request_id")
+        self.task: Optional[asyncio.Task] = None
+        self.finished = False
+
+
+class ConnectionPipeline:
+    """Reads messages from one WebSocket and runs them through ``handler``.
+
+    Up to ``concurrency`` requests run at once and up to ``queue_size`` more
+    wait; beyond that, or when the AdmissionController is at its per-session
+    or global limit, the client gets a "busy" reply straight away instead
+    of the work piling up. A newer message for a session supersedes (and
+    cancels) that session's pending requests. Replies echo the message's
+    ``request_id`` so pipelining clients can match them up.
+
+    The server answers ``{"type": "ping"}`` with a pong, pings silent
+    clients, and closes connections that stop answering or stay idle.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, websocket: WebSocket,
+                 handler: Callable[[Dict[str, Any], Callable[[Dict[str, Any]], Awaitable[None]]], Awaitable[None]],
+                 admission: AdmissionController,
+                 concurrency: int = WS_CONNECTION_CONCURRENCY,
+                 queue_size: int = WS_QUEUE_SIZE,
+                 cancel_superseded: bool = WS_CANCEL_SUPERSEDED,
+                 idle_timeout: float = WS_IDLE_TIMEOUT_SECONDS,
+                 heartbeat_interval: float = WS_HEARTBEAT_INTERVAL_SECONDS,
+                 heartbeat_timeout: float = WS_HEARTBEAT_TIMEOUT_SECONDS):
+        self.websocket = websocket
+        self.handler = handler
+        self.admission = admission
+        self.concurrency = max(concurrency, 1)
+        self.queue_size = queue_size
+        self.cancel_superseded = cancel_superseded
+        self.idle_timeout = idle_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        # Requests without a session id (new sessions) share a per-connection key
+        self.connection_key = f"connection-{next(self._ids)}"
+        self._queue: Deque[_Request] = deque()
+        self._has_work = asyncio.Event()
+        self._pending: Dict[str, List[_Request]] = {}
+        self._send_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        self._last_message = loop.time()
+        self._last_activity = loop.time()
+        self._ping_sent_at: Optional[float] = None
+
+    async def send(self, payload: Dict[str, Any], request_id: Any = None):
+        if request_id is not None:
+            payload = {**payload, "request_id": request_id}
+        async with self._send_lock:
+            await self.websocket.send_json(payload)
+
+    async def run(self):
+        workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        try:
+            await self._read()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            requests = [request for pending in self._pending.values() for request in pending]
+            for request in requests:
+                self._cancel(request)
+            tasks = [request.task for request in requests if request.task is not None]
+            await asyncio.gather(*workers, *tasks, return_exceptions=True)
+
+    def _next_deadline(self) -> Optional[float]:
+        deadlines = []
+        if self.heartbeat_interval > 0:
+            if self._ping_sent_at is not None:
+                deadlines.append(self._ping_sent_at + self.heartbeat_timeout)
+            else:
+                deadlines.append(self._last_message + self.heartbeat_interval)
+        if self.idle_timeout > 0 and not self._pending:
+            deadlines.append(self._last_activity + self.idle_timeout)
+        return min(deadlines) if deadlines else None
+
+    async def _close(self, reason: str):
+        metrics.inc("ws_connections_closed_total", reason=reason)
+        logger.info(f"Closing WebSocket {self.connection_key}: {reason}")
+        await self.websocket.close(code=1001, reason=reason)
+
+    async def _read(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline = self._next_deadline()
+            try:
+                text = await asyncio.wait_for(
+                    self.websocket.receive_text(),
+                    timeout=None if deadline is None else max(deadline - loop.time(), 0)
+                )
+            except asyncio.TimeoutError:
+                now = loop.time()
+                if self._ping_sent_at is not None and now >= self._ping_sent_at + self.heartbeat_timeout:
+                    await self._close("heartbeat timeout")
+                    return
+                if self.idle_timeout > 0 and not self._pending and now >= self._last_activity + self.idle_timeout:
+                    await self._close("idle timeout")
+                    return
+                if (self._ping_sent_at is None and self.heartbeat_interval > 0
+                        and now >= self._last_message + self.heartbeat_interval):
+                    self._ping_sent_at = now
+                    await self.send({"type": "ping"})
+                continue
+            except WebSocketDisconnect:
+                metrics.inc("ws_connections_closed_total", reason="client")
+                return
+            self._last_message = loop.time()
+            self._ping_sent_at = None
+            await self._receive(text)
+
+    async def _receive(self, text: str):
+        try:
+            message = json.loads(text)
+        except json.JSONDecodeError:
+            await self.send({"success": False, "message": "Invalid JSON format", "data": None})
+            return
+        if not isinstance(message, dict):
+            await self.send({"success": False, "message": "Expected a JSON object", "data": None})
+            return
+        if message.get("type") == "pong":
+            return
+        if message.get("type") == "ping":
+            await self.send({"type": "pong"}, message.get("request_id"))
+            return
+
+        self._last_activity = asyncio.get_running_loop().time()
+        key = message.get("session_id") or self.connection_key
+        if self.cancel_superseded:
+            for request in list(self._pending.get(key, [])):
+                self._cancel(request)
+                metrics.inc("ws_requests_total", outcome="superseded")
+                await self.send({
+                    "type": "cancelled",
+                    "success": False,
+                    "message": "Superseded by a newer message",
+                    "error": "superseded"
+                }, request.request_id)
+
+        if len(self._queue) >= self.queue_size or not self.admission.try_acquire(key):
+            metrics.inc("ws_requests_total", outcome="busy")
+            await self.send({
+                "type": "busy",
+                "success": False,
+                "message": "Server is busy, please retry shortly",
+                "error": "busy",
+                "retry_after": BUSY_RETRY_AFTER_SECONDS
+            }, message.get("request_id"))
+            return
+
+        metrics.inc("ws_requests_total", outcome="accepted")
+        request = _Request(message, key)
+        self._pending.setdefault(key, []).append(request)
+        self._queue.append(request)
+        self._has_work.set()
+
+    def _cancel(self, request: _Request):
+        if request.task is not None:
+            request.task.cancel()
+        elif request in self._queue:
+            self._queue.remove(request)
+        self._finish(request)
+
+    def _finish(self, request: _Request):
+        if request.finished:
+            return
+        request.finished = True
+        self.admission.release(request.key)
+        requests = self._pending.get(request.key, [])
+        if request in requests:
+            requests.remove(request)
+        if not requests:
+            self._pending.pop(request.key, None)
+        self._last_activity = asyncio.get_running_loop().time()
+
+    async def _work(self):
+        while True:
+            while not self._queue:
+                self._has_work.clear()
+                await self._has_work.wait()
+            request = self._queue.popleft()
+            request.task = asyncio.create_task(self._run(request))
+            # wait() rather than await, so cancelling the request doesn't stop the worker
+            await asyncio.wait({request.task})
+
+    async def _run(self, request: _Request):
+        async def send(payload: Dict[str, Any]):
+            await self.send(payload, request.request_id)
+
+        try:
+            await self.handler(request.message, send)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error handling WebSocket message: {str(e)}")
+            try:
+                await send({"success": False, "message": "Error processing message", "error": str(e)})
+            except Exception:
+                pass
+        finally:
+            self._finish(request)
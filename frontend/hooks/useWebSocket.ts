@@ -38,6 +38,13 @@ export const useWebSocket = () => {
       console.error('WebSocket error:', event);
     };
 
+    // Answer server heartbeats so the connection isn't closed as dead
+    ws.addEventListener('message', (event) => {
+      if (JSON.parse(event.data).type === 'ping') {
+        ws.send(JSON.stringify({ type: 'pong' }));
+      }
+    });
+
     setSocket(ws);
 
     return () => {
@@ -55,6 +62,9 @@ export const useWebSocket = () => {
       const handleMessage = (event: MessageEvent) => {
         try {
           const response = JSON.parse(event.data);
+          if (response.type === 'ping') {
+            return;
+          }
           socket.removeEventListener('message', handleMessage);
           resolve(response);
         } catch (error) {
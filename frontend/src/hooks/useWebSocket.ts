@@ -27,6 +27,11 @@ export const useWebSocket = () => {
       };
 
       websocket.onmessage = (event) => {
+        // Answer server heartbeats so the connection isn't closed as dead
+        if (JSON.parse(event.data).type === 'ping') {
+          websocket.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
         setLastMessage(event.data);
       };
 